@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+
+import asyncio
+import threading
+
+class BackgroundLoop(object):
+  # an event loop running forever in a daemon thread. work submitted here shares the sessions, connections and
+  # clients bound to the loop across calls, and sync callers work inside a running loop too
+  def __init__(self, name = 'background-loop'):
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target = self.loop.run_forever, name = name, daemon = True)
+    self.thread.start()
+  def submit(self, coro):
+    return asyncio.run_coroutine_threadsafe(coro, self.loop)
+  def run(self, coro):
+    if threading.current_thread() is self.thread:
+      coro.close()
+      raise RuntimeError(f'cannot block on {self.thread.name} from inside it, await the coroutine instead!')
+    future = self.submit(coro)
+    try:
+      return future.result()
+    except BaseException:
+      # interrupted callers cancel the work instead of leaving it running in the background
+      future.cancel()
+      raise
+  async def wrap(self, coro):
+    # await a coroutine on the background loop from any loop
+    if asyncio.get_running_loop() is self.loop:
+      return await coro
+    return await asyncio.wrap_future(self.submit(coro))
+  def close(self):
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    self.loop.close()
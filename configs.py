@@ -9,3 +9,59 @@ langsmith_trace = 'true'
 langsmith_api_key = ''
 
 workspace_dir = "./workspace"
+
+shell_control_mode = False
+shell_pool_size = 0
+shell_pool_idle_timeout = 600
+shell_pool_reuse = False
+shell_read_max_bytes = 64 * 1024
+
+file_index_ttl = 1.0
+file_read_max_bytes = 1024**2
+file_max_workers = 8
+file_grep_processes = 4
+file_async_workers = 16
+
+vision_async_workers = 4
+vision_cache_bytes = 64 * 1024**2
+vision_cache_spill = False
+vision_max_width = 1920
+vision_max_height = 1080
+vision_jpeg_quality = 85
+vision_png_compress_level = 6
+vision_optimize = True
+vision_passthrough_max_bytes = 1024**2
+vision_fast_resample_ratio = 2.0
+vision_max_tokens = None
+
+computer_screenshot_max_tokens = None
+computer_screenshot_format = "JPEG"
+computer_screenshot_quality = 80
+computer_sequence_delay = 0.1
+computer_wait_fps = 10
+computer_typing_interval = 0.01
+computer_typing_keys_max_chars = 32
+computer_paste_hotkey = "ctrl+v"
+computer_paste_settle = 0.2
+
+browser_pool_size = 2
+browser_pool_idle_timeout = 300
+browser_headless = True
+browser_max_concurrency = 2
+browser_task_timeout = 300
+browser_history_dir = "./workspace/.browser_history"
+browser_history_ttl = 7 * 24 * 3600
+browser_history_max_runs = 100
+
+llm_cache = None # None, 'memory' or 'sqlite'
+llm_cache_size = 1024
+llm_cache_path = "./workspace/.llm_cache.sqlite3"
+llm_cache_ttl = 24 * 3600
+llm_cache_force = False
+llm_max_connections = 100
+llm_max_keepalive_connections = 20
+llm_keepalive_expiry = 30.0
+llm_batch_concurrency = 8
+llm_max_retries = 4
+llm_retry_base_delay = 0.5
+llm_retry_max_delay = 30.0
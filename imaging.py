@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+from io import BytesIO
+import base64
+import math
+import numpy as np
+from PIL import Image
+
+# Qwen-VL models spend one token on every 28x28 patch of the image
+PIXELS_PER_TOKEN = 28 * 28
+DEFAULT_MAX_WIDTH = 1920
+DEFAULT_MAX_HEIGHT = 1080
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_FAST_RESAMPLE_RATIO = 2.0
+MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+class PreparedImage(object):
+  def __init__(self, data, format, size):
+    self.data = data
+    self.format = format
+    self.size = size
+  @property
+  def mime_type(self):
+    return MIME_TYPES[self.format]
+  def to_base64(self):
+    return base64.b64encode(self.data).decode('utf-8')
+  def to_data_url(self):
+    return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+def to_pil(image):
+  # numpy frames follow the opencv channel order (BGR or BGRA), bytes are an encoded image
+  if isinstance(image, Image.Image):
+    return image
+  elif isinstance(image, np.ndarray):
+    if image.ndim == 3 and image.shape[2] == 3:
+      image = image[..., ::-1]
+    elif image.ndim == 3 and image.shape[2] == 4:
+      image = image[..., [2, 1, 0, 3]]
+    return Image.fromarray(np.ascontiguousarray(image))
+  elif isinstance(image, (bytes, bytearray)):
+    return Image.open(BytesIO(image))
+  else:
+    raise RuntimeError('image can only be given in PIL image, np.ndarray or bytes format!')
+
+def target_ratio(width, height, max_width = None, max_height = None, max_pixels = None, max_tokens = None):
+  # scale factor, at most 1, fitting the image into the size limits and the pixel or token budget
+  ratios = [1.0]
+  if max_width is not None: ratios.append(max_width / width)
+  if max_height is not None: ratios.append(max_height / height)
+  if max_tokens is not None:
+    max_pixels = min(max_pixels or math.inf, max_tokens * PIXELS_PER_TOKEN)
+  if max_pixels is not None: ratios.append(math.sqrt(max_pixels / (width * height)))
+  return min(ratios)
+
+def choose_format(img):
+  # screenshots, charts and text have few distinct colors and compress better and sharper as PNG, photos as JPEG
+  if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+    return "PNG"
+  thumb = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+  thumb = thumb.resize((min(thumb.width, 256), min(thumb.height, 256)), Image.Resampling.NEAREST)
+  return "PNG" if thumb.getcolors(maxcolors = 256) is not None else "JPEG"
+
+def encode(img, format, quality = DEFAULT_JPEG_QUALITY, png_compress_level = DEFAULT_PNG_COMPRESS_LEVEL, optimize = False):
+  output = BytesIO()
+  if format == "GIF":
+    img.save(output, format = "GIF", optimize = optimize)
+  elif format == "PNG":
+    img.save(output, format = "PNG", optimize = optimize, compress_level = png_compress_level)
+  elif format == "WEBP":
+    img.save(output, format = "WEBP", quality = quality, method = 4)
+  else:
+    img.save(output, format = "JPEG", quality = quality, optimize = optimize)
+  return output.getvalue()
+
+def prepare_image(image, max_width = DEFAULT_MAX_WIDTH, max_height = DEFAULT_MAX_HEIGHT, max_pixels = None, max_tokens = None, region = None, format = "auto", quality = DEFAULT_JPEG_QUALITY, png_compress_level = DEFAULT_PNG_COMPRESS_LEVEL, optimize = False, max_bytes = None, fast_resample_ratio = DEFAULT_FAST_RESAMPLE_RATIO):
+  # crop to the region of interest (left, top, right, bottom), downscale to the size limits and the pixel or token budget
+  # and encode as JPEG, PNG, WEBP or GIF. format auto picks PNG or JPEG by the content. when max_bytes is given,
+  # the quality and then the resolution are lowered until the encoded image fits
+  img = to_pil(image)
+  width, height = img.size
+  if region is not None:
+    left, top, right, bottom = max(region[0], 0), max(region[1], 0), min(region[2], width), min(region[3], height)
+    if left >= right or top >= bottom:
+      raise ValueError(f"region {tuple(region)} is outside of the image of size {width}x{height}!")
+    width, height = right - left, bottom - top
+  ratio = target_ratio(width, height, max_width, max_height, max_pixels, max_tokens)
+  target = (max(int(width * ratio), 1), max(int(height * ratio), 1))
+  if ratio < 1 and img.format == "JPEG":
+    # decode at the smallest scale of 1/2, 1/4 or 1/8 that is not below the target size
+    full_width = img.width
+    img.draft(None, (math.ceil(img.width * ratio), math.ceil(img.height * ratio)))
+    scale = img.width / full_width
+    if region is not None:
+      left, top, right, bottom = int(left * scale), int(top * scale), max(int(right * scale), int(left * scale) + 1), max(int(bottom * scale), int(top * scale) + 1)
+  if region is not None:
+    img = img.crop((left, top, right, bottom))
+  if format == "auto":
+    format = choose_format(img)
+  if img.mode == "P":
+    img = img.convert("RGBA")
+  if img.mode in ("RGBA", "LA") and format in ("JPEG", "GIF"):
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(img, mask = img.split()[-1])
+    img = background
+  elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+    img = img.convert("RGB")
+  while True:
+    if img.size != target:
+      # large downscales reduce by whole factors first and then resample bilinearly, which is close to LANCZOS at a fraction of the cost
+      if max(img.width / target[0], img.height / target[1]) >= fast_resample_ratio:
+        resized = img.resize(target, Image.Resampling.BILINEAR, reducing_gap = 2.0)
+      else:
+        resized = img.resize(target, Image.Resampling.LANCZOS)
+    else:
+      resized = img
+    data = encode(resized, format, quality, png_compress_level, optimize)
+    if max_bytes is None or len(data) <= max_bytes:
+      break
+    # lossy formats trade quality first, then every format trades resolution
+    for lower_quality in (70, 55, 40):
+      if format not in ("JPEG", "WEBP") or lower_quality >= quality: continue
+      data = encode(resized, format, lower_quality, png_compress_level, optimize)
+      if len(data) <= max_bytes: break
+    if len(data) <= max_bytes or min(target) <= 16:
+      break
+    target = (max(int(target[0] * 0.75), 1), max(int(target[1] * 0.75), 1))
+  return PreparedImage(data, format, resized.size)
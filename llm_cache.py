@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+from os import makedirs
+from os.path import dirname, abspath
+from collections import OrderedDict
+from concurrent.futures import Future
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+def cache_key(messages, params):
+  # the same messages and sampling parameters map to the same key whatever the order of dict keys
+  payload = json.dumps({'messages': messages, 'params': params}, sort_keys = True, separators = (',', ':'), ensure_ascii = False, default = str)
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MemoryBackend(object):
+  # least recently used entries are dropped beyond max_entries
+  def __init__(self, max_entries = 1024):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+  def get(self, key, ttl = None):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, created = entry
+      if ttl is not None and time.time() - created > ttl:
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return value
+  def set(self, key, value):
+    with self.lock:
+      self.entries[key] = (value, time.time())
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last = False)
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+class SQLiteBackend(object):
+  # entries persist across processes and runs, e.g. for evaluation reruns
+  def __init__(self, path):
+    makedirs(dirname(abspath(path)), exist_ok = True)
+    self.conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+    self.conn.execute('pragma journal_mode=wal')
+    self.conn.execute('create table if not exists responses (key text primary key, value text not null, created real not null)')
+    self.lock = threading.Lock()
+  def get(self, key, ttl = None):
+    with self.lock:
+      row = self.conn.execute('select value, created from responses where key = ?', (key,)).fetchone()
+      if row is None:
+        return None
+      if ttl is not None and time.time() - row[1] > ttl:
+        self.conn.execute('delete from responses where key = ?', (key,))
+        return None
+      return row[0]
+  def set(self, key, value):
+    with self.lock:
+      self.conn.execute('insert or replace into responses (key, value, created) values (?, ?, ?)', (key, value, time.time()))
+  def clear(self):
+    with self.lock:
+      self.conn.execute('delete from responses')
+
+class ResponseCache(object):
+  # responses keyed on the messages and sampling parameters. sampled requests (temperature > 0) bypass the cache
+  # unless force is set, and concurrent identical requests share one upstream call
+  def __init__(self, backend, ttl = None, force = False):
+    self.backend = backend
+    self.ttl = ttl
+    self.force = force
+    self.inflight = dict()
+    self.lock = threading.Lock()
+  def cacheable(self, params):
+    temperature = params.get('temperature')
+    return self.force or temperature is None or temperature <= 0
+  def claim(self, key):
+    # the first caller of a key computes it, the others wait on its future
+    with self.lock:
+      future = self.inflight.get(key)
+      if future is not None:
+        return False, future
+      future = Future()
+      self.inflight[key] = future
+      return True, future
+  def resolve(self, key, future, value = None, error = None):
+    with self.lock:
+      del self.inflight[key]
+    # a done future can only come from a caller that cancelled it, which must not fail the others
+    if future.done():
+      return
+    if error is None:
+      future.set_result(value)
+    else:
+      future.set_exception(error)
+  def get_or_compute(self, messages, params, compute):
+    if not self.cacheable(params):
+      return compute()
+    key = cache_key(messages, params)
+    owner, future = self.claim(key)
+    if not owner:
+      return json.loads(future.result())
+    try:
+      value = self.backend.get(key, self.ttl)
+      if value is None:
+        value = json.dumps(compute(), default = str)
+        self.backend.set(key, value)
+    except BaseException as e:
+      self.resolve(key, future, error = e)
+      raise
+    self.resolve(key, future, value)
+    return json.loads(value)
+  async def aget_or_compute(self, messages, params, acompute):
+    if not self.cacheable(params):
+      return await acompute()
+    key = cache_key(messages, params)
+    owner, future = self.claim(key)
+    if not owner:
+      # shielded, so that a cancelled waiter does not cancel the shared future under the owner and the other waiters
+      return json.loads(await asyncio.shield(asyncio.wrap_future(future)))
+    try:
+      # backends do blocking io, e.g. sqlite, which must not stall the event loop
+      value = await asyncio.to_thread(self.backend.get, key, self.ttl)
+      if value is None:
+        value = json.dumps(await acompute(), default = str)
+        await asyncio.to_thread(self.backend.set, key, value)
+    except BaseException as e:
+      self.resolve(key, future, error = e)
+      raise
+    self.resolve(key, future, value)
+    return json.loads(value)
+
+def load_response_cache(configs):
+  if configs.llm_cache is None:
+    return None
+  elif configs.llm_cache == 'memory':
+    backend = MemoryBackend(configs.llm_cache_size)
+  elif configs.llm_cache == 'sqlite':
+    backend = SQLiteBackend(configs.llm_cache_path)
+  else:
+    raise ValueError(f"unknown llm_cache backend '{configs.llm_cache}', use None, 'memory' or 'sqlite'")
+  return ResponseCache(backend, ttl = configs.llm_cache_ttl, force = configs.llm_cache_force)
@@ -1,21 +1,17 @@
 #!/usr/bin/python3
 
 from abc import ABC, abstractmethod
-import base64
 import numpy as np
-import cv2
+from imaging import prepare_image
 
 class Message(ABC):
-  def encode_img(self, image):
+  def encode_img(self, image, max_tokens = None, region = None):
     if type(image) is str:
       # image's url is given
       return image
     elif type(image) is np.ndarray:
-      success, encoded_image = cv2.imencode('.png', image)
-      assert success, "failed to encode numpy to png image!"
-      png_bytes = encoded_image.tobytes()
-      png_b64 = base64.b64encode(png_bytes).decode('utf-8')
-      return f"data:image/png;base64,{png_b64}"
+      # frames are downscaled to the token budget and sent as png or jpeg depending on the content
+      return prepare_image(image, max_tokens = max_tokens, region = region).to_data_url()
     else:
       raise RuntimeError('image can only be given in url or np.ndarray format!')
   @abstractmethod
@@ -30,14 +26,16 @@ class SystemMessage(Message):
     return {'role': 'system', 'content': self.content}
 
 class HumanMessage(Message):
-  def __init__(self, content, image = None):
+  def __init__(self, content, image = None, max_tokens = None, region = None):
     assert type(content) is str
-    assert type(image) is np.ndarray
+    assert image is None or type(image) in (str, np.ndarray)
     self.content = content
     self.image = image
+    self.max_tokens = max_tokens
+    self.region = region
   def to_json(self,):
     content = list()
     content.append({'type': 'text', 'text': self.content})
     if self.image is not None:
-      content.append({'type': 'image_url', "image_url": {'url': self.encode_img(self.image)}})
+      content.append({'type': 'image_url', "image_url": {'url': self.encode_img(self.image, self.max_tokens, self.region)}})
     return {'role': 'user', 'content': content}
@@ -1,12 +1,127 @@
 #!/usr/bin/python3
 
-from openai import OpenAI
+from typing import Any, List, Optional
+import asyncio
+import random
+import threading
+import time
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
 from prompt import Prompt
+from llm_cache import load_response_cache
+from background import BackgroundLoop
+
+http_clients_lock = threading.Lock()
+http_clients = dict()
+async_http_clients = dict()
+batch_loop_instance = None
+
+def http_limits(configs):
+  return httpx.Limits(
+    max_connections = configs.llm_max_connections,
+    max_keepalive_connections = configs.llm_max_keepalive_connections,
+    keepalive_expiry = configs.llm_keepalive_expiry
+  )
+
+def shared_http_client(configs):
+  # one connection pool per limits for all sync clients, so keep-alive connections are reused across models
+  limits = http_limits(configs)
+  key = (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry)
+  with http_clients_lock:
+    if key not in http_clients:
+      http_clients[key] = DefaultHttpxClient(limits = limits)
+    return http_clients[key]
+
+def prune_closed_loops(clients):
+  # the clients of a loop reference it, so entries are dropped explicitly once the loop is closed, e.g. by asyncio.run
+  for loop in [loop for loop in clients if loop.is_closed()]:
+    del clients[loop]
+
+def shared_async_http_client(configs):
+  # async connections are bound to the event loop that opened them, so the pool is shared per running loop
+  limits = http_limits(configs)
+  key = (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry)
+  loop = asyncio.get_running_loop()
+  with http_clients_lock:
+    prune_closed_loops(async_http_clients)
+    clients = async_http_clients.setdefault(loop, dict())
+    if key not in clients:
+      clients[key] = DefaultAsyncHttpxClient(limits = limits)
+    return clients[key]
+
+def batch_loop():
+  # sync batches all run on one long lived loop, so they share its clients and keep-alive connections
+  global batch_loop_instance
+  with http_clients_lock:
+    if batch_loop_instance is None:
+      batch_loop_instance = BackgroundLoop(name = 'llm-batch-loop')
+    return batch_loop_instance
+
+class BatchResult(object):
+  def __init__(self, text = None, error = None, attempts = 0):
+    self.text = text
+    self.error = error
+    self.attempts = attempts
+  @property
+  def success(self):
+    return self.error is None
+  def __repr__(self):
+    return f"BatchResult(text = {self.text!r}, error = {self.error!r}, attempts = {self.attempts})"
+
+class AdaptiveLimiter(object):
+  # caps concurrent requests, halving the cap on every rate limit response and growing it back by one per
+  # round of successful requests (additive increase, multiplicative decrease)
+  def __init__(self, max_concurrency):
+    self.max_concurrency = max_concurrency
+    self.limit = float(max_concurrency)
+    self.active = 0
+    self.resume_at = 0
+    self.condition = asyncio.Condition()
+  async def acquire(self):
+    async with self.condition:
+      await self.condition.wait_for(lambda: self.active < int(self.limit))
+      self.active += 1
+    # a retry-after from the server pauses every request, not just the one that got it
+    delay = self.resume_at - time.monotonic()
+    if delay > 0:
+      await asyncio.sleep(delay)
+  async def release(self, throttled = False, retry_after = None):
+    async with self.condition:
+      self.active -= 1
+      if throttled:
+        self.limit = max(1.0, self.limit / 2)
+        if retry_after is not None:
+          self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+      else:
+        self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+      self.condition.notify_all()
+
+def retry_after(error):
+  try:
+    return float(error.response.headers.get('retry-after'))
+  except (AttributeError, TypeError, ValueError):
+    return None
+
+def dump_chat_result(result):
+  return {
+    'generations': [{'message': message_to_dict(generation.message), 'generation_info': generation.generation_info} for generation in result.generations],
+    'llm_output': result.llm_output
+  }
+
+def load_chat_result(data):
+  return ChatResult(
+    generations = [ChatGeneration(message = messages_from_dict([generation['message']])[0], generation_info = generation['generation_info']) for generation in data['generations']],
+    llm_output = data['llm_output']
+  )
 
 class LLM(ChatOpenAI):
+  response_cache: Optional[Any] = None
   def __init__(self, configs, tags = None):
-    super(Tongyi, self).__init__(
+    super(LLM, self).__init__(
       api_key = configs.dashscope_key,
       base_url = configs.dashscope_url,
       model_name = configs.dashscope_llm_model,
@@ -17,19 +132,134 @@ class LLM(ChatOpenAI):
         "top_k": 20,
         "enable_thinking": False
       },
-      tags = tags
+      tags = tags,
+      http_client = shared_http_client(configs),
+      response_cache = load_response_cache(configs)
+    )
+  def _cache_params(self, stop, kwargs):
+    return {**self._default_params, **kwargs, 'stop': stop}
+  def _generate(self, messages, stop = None, run_manager = None, **kwargs):
+    if self.response_cache is None:
+      return super(LLM, self)._generate(messages, stop = stop, run_manager = run_manager, **kwargs)
+    result = self.response_cache.get_or_compute(
+      [message_to_dict(message) for message in messages],
+      self._cache_params(stop, kwargs),
+      lambda: dump_chat_result(super(LLM, self)._generate(messages, stop = stop, run_manager = run_manager, **kwargs))
     )
+    return load_chat_result(result)
+  async def _agenerate(self, messages, stop = None, run_manager = None, **kwargs):
+    if self.response_cache is None:
+      return await super(LLM, self)._agenerate(messages, stop = stop, run_manager = run_manager, **kwargs)
+    async def generate():
+      return dump_chat_result(await super(LLM, self)._agenerate(messages, stop = stop, run_manager = run_manager, **kwargs))
+    result = await self.response_cache.aget_or_compute(
+      [message_to_dict(message) for message in messages],
+      self._cache_params(stop, kwargs),
+      generate
+    )
+    return load_chat_result(result)
 
 class VLM(object):
   def __init__(self, configs):
+    self.configs = configs
     self.client = OpenAI(
       api_key = configs.dashscope_key,
-      base_url = configs.dashscope_url
+      base_url = configs.dashscope_url,
+      http_client = shared_http_client(configs)
     )
-  def inference(self, prompt: Prompt):
-    messages = prompt.to_json()
+    self.async_clients = dict()
+    self.model = configs.dashscope_vlm_model
+    self.cache = load_response_cache(configs)
+  @property
+  def async_client(self):
+    # an AsyncOpenAI client on the pooled connections of the running loop
+    loop = asyncio.get_running_loop()
+    http_client = shared_async_http_client(self.configs)
+    with http_clients_lock:
+      prune_closed_loops(self.async_clients)
+      if loop not in self.async_clients:
+        self.async_clients[loop] = AsyncOpenAI(
+          api_key = self.configs.dashscope_key,
+          base_url = self.configs.dashscope_url,
+          http_client = http_client
+        )
+      return self.async_clients[loop]
+  def complete(self, messages, **kwargs):
     response = self.client.chat.completions.create(
-      model = configs.dashscope_vlm_model,
+      model = self.model,
+      messages = messages,
+      **kwargs
+    )
+    return response.choices[0].message.content
+  async def acomplete(self, messages, client = None, **kwargs):
+    response = await (client or self.async_client).chat.completions.create(
+      model = self.model,
       messages = messages,
+      **kwargs
     )
     return response.choices[0].message.content
+  def inference(self, prompt: Prompt, **kwargs):
+    # kwargs are sampling parameters like temperature, passed on to the completion request
+    messages = prompt.to_json()
+    if self.cache is None:
+      return self.complete(messages, **kwargs)
+    return self.cache.get_or_compute(messages, {'model': self.model, **kwargs}, lambda: self.complete(messages, **kwargs))
+  async def ainference(self, prompt: Prompt, **kwargs):
+    messages = prompt.to_json()
+    if self.cache is None:
+      return await self.acomplete(messages, **kwargs)
+    return await self.cache.aget_or_compute(messages, {'model': self.model, **kwargs}, lambda: self.acomplete(messages, **kwargs))
+  def stream_inference(self, prompt: Prompt, **kwargs):
+    # yield the text as the tokens arrive. streams always go upstream, the cache only serves whole responses
+    stream = self.client.chat.completions.create(
+      model = self.model,
+      messages = prompt.to_json(),
+      stream = True,
+      **kwargs
+    )
+    with stream:
+      for chunk in stream:
+        if len(chunk.choices) and chunk.choices[0].delta.content:
+          yield chunk.choices[0].delta.content
+  async def astream_inference(self, prompt: Prompt, **kwargs):
+    stream = await self.async_client.chat.completions.create(
+      model = self.model,
+      messages = prompt.to_json(),
+      stream = True,
+      **kwargs
+    )
+    async with stream:
+      async for chunk in stream:
+        if len(chunk.choices) and chunk.choices[0].delta.content:
+          yield chunk.choices[0].delta.content
+  async def abatch_item(self, prompt, limiter, client, **kwargs):
+    messages = prompt.to_json()
+    for attempt in range(self.configs.llm_max_retries + 1):
+      await limiter.acquire()
+      try:
+        if self.cache is None:
+          text = await self.acomplete(messages, client, **kwargs)
+        else:
+          text = await self.cache.aget_or_compute(messages, {'model': self.model, **kwargs}, lambda: self.acomplete(messages, client, **kwargs))
+      except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+        throttled = isinstance(e, openai.RateLimitError)
+        await limiter.release(throttled = throttled, retry_after = retry_after(e))
+        if attempt == self.configs.llm_max_retries:
+          return BatchResult(error = e, attempts = attempt + 1)
+        delay = min(self.configs.llm_retry_max_delay, self.configs.llm_retry_base_delay * 2 ** attempt)
+        await asyncio.sleep(retry_after(e) or delay * random.uniform(0.5, 1))
+      except Exception as e:
+        await limiter.release()
+        return BatchResult(error = e, attempts = attempt + 1)
+      else:
+        await limiter.release()
+        return BatchResult(text = text, attempts = attempt + 1)
+  async def abatch_inference(self, prompts: List[Prompt], max_concurrency: Optional[int] = None, **kwargs):
+    # results come back in the order of prompts, a failed prompt carries its error instead of failing the batch
+    limiter = AdaptiveLimiter(max_concurrency or self.configs.llm_batch_concurrency)
+    # retries are done here, so that every rate limit response reaches the limiter
+    client = self.async_client.with_options(max_retries = 0)
+    return await asyncio.gather(*[self.abatch_item(prompt, limiter, client, **kwargs) for prompt in prompts])
+  def batch_inference(self, prompts: List[Prompt], max_concurrency: Optional[int] = None, **kwargs):
+    # also works inside a running loop, e.g. jupyter, as the batch never runs on the loop of the caller
+    return batch_loop().run(self.abatch_inference(prompts, max_concurrency, **kwargs))
@@ -3,6 +3,7 @@
 import sys
 from os.path import join, exists, dirname, abspath
 import unittest
+import asyncio
 
 sys.path.append(abspath(join(dirname(__file__), '..')))
 
@@ -18,6 +19,39 @@ class TestBrowser(unittest.TestCase):
     print('has_errors:', result.has_errors)
     print('answer:', result.answer)
     print('screenshot_path:', result.screenshot_path)
+  def test_browser_history(self,):
+    browser_tool = load_browser_tool(configs)
+    result = browser_tool.invoke({'query': 'What is the GDP per capita of Hong Kong?'})
+    print('steps:', result.steps)
+    page = browser_tool.invoke({'history': {'history_path': result.history_path, 'content': 'steps', 'offset': 0, 'limit': 2}})
+    print(page)
+    assert page.total == result.steps and len(page.items) == min(2, result.steps)
+  def test_browser_history_path(self,):
+    browser_tool = load_browser_tool(configs)
+    # only histories saved by the tool can be read
+    with self.assertRaises(ValueError):
+      browser_tool.invoke({'history': {'history_path': abspath(__file__), 'content': 'steps'}})
+  def test_browser_in_running_loop(self,):
+    browser_tool = load_browser_tool(configs)
+    async def call():
+      # a sync call from inside a running loop, as in jupyter
+      return browser_tool.invoke({'query': 'What is the GDP per capita of Hong Kong?'})
+    result = asyncio.run(call())
+    print('answer:', result.answer)
+  def test_browser_pool(self,):
+    browser_tool = load_browser_tool(configs)
+    for query in ['What is the GDP per capita of Hong Kong?', 'What is the population of Hong Kong?']:
+      result = browser_tool.invoke({'query': query})
+      print('answer:', result.answer)
+    # the second query reuses the browser launched for the first one
+    assert len(browser_tool.config.pool.idle) == 1
+  def test_browser_queries(self,):
+    browser_tool = load_browser_tool(configs)
+    queries = ['What is the GDP per capita of Hong Kong?', 'What is the population of Hong Kong?', 'What is the area of Hong Kong?']
+    result = browser_tool.invoke({'queries': queries, 'timeout': 600})
+    for query, output in zip(queries, result.results):
+      print(query, output.answer)
+    assert len(result.results) == len(queries)
 
 if __name__ == "__main__":
   unittest.main()
@@ -46,6 +46,15 @@ class TestComputer(unittest.TestCase):
         'text': 'test abc'
       }
     })
+  def test_typing_paste(self,):
+    computer_tool = load_computer_tool(configs)
+    result = computer_tool.invoke({
+      'action': 'typing',
+      'typing': {
+        'text': '测试 abc ' * 100
+      }
+    })
+    print(result)
   def test_press(self,):
     computer_tool = load_computer_tool(configs)
     result = computer_tool.invoke({
@@ -62,6 +71,45 @@ class TestComputer(unittest.TestCase):
         'duration': 3
       }
     })
+  def test_wait_until_stable(self,):
+    computer_tool = load_computer_tool(configs)
+    result = computer_tool.invoke({
+      'action': 'wait_until_stable',
+      'wait_until_stable': {
+        'stable_for': 0.5,
+        'timeout': 5
+      }
+    })
+    print(result)
+  def test_wait_for_change(self,):
+    computer_tool = load_computer_tool(configs)
+    result = computer_tool.invoke({
+      'action': 'wait_for_change',
+      'wait_for_change': {
+        'region': [0, 0, 400, 400],
+        'timeout': 1
+      }
+    })
+    print(result)
+  def test_wait_region_outside(self,):
+    computer_tool = load_computer_tool(configs)
+    with self.assertRaises(ValueError):
+      computer_tool.invoke({
+        'action': 'wait_for_change',
+        'wait_for_change': {
+          'region': [100000, 100000, 100400, 100400],
+          'timeout': 1
+        }
+      })
+    # the capture is still usable after a bad region
+    result = computer_tool.invoke({
+      'action': 'wait_for_change',
+      'wait_for_change': {
+        'region': [0, 0, 400, 400],
+        'timeout': 1
+      }
+    })
+    print(result)
   def test_mouse_down(self,):
     computer_tool = load_computer_tool(configs)
     result = computer_tool.invoke({
@@ -105,9 +153,37 @@ class TestComputer(unittest.TestCase):
       'action': 'screenshot',
       'screenshot': {}
     })
-    img_bytes = base64.b64decode(result.screenshot.encode('utf-8'))
-    with open('screenshot.png', 'wb') as f:
+    img_bytes = base64.b64decode(result.result.encode('utf-8'))
+    with open('screenshot' + {'image/png': '.png', 'image/jpeg': '.jpg'}[result.mime_type], 'wb') as f:
       f.write(img_bytes)
+  def test_sequence(self,):
+    computer_tool = load_computer_tool(configs)
+    result = computer_tool.invoke({
+      'action': 'sequence',
+      'sequence': {
+        'steps': [
+          {'action': 'move_to', 'move_to': {'x': 300, 'y': 300}},
+          {'action': 'click', 'click': {'x': 300, 'y': 300, 'button': 'left'}},
+          {'action': 'typing', 'typing': {'text': 'test abc'}},
+          {'action': 'press', 'press': {'key': 'enter'}}
+        ],
+        'screenshot': {}
+      }
+    })
+    print(result.steps)
+    assert all(step.success for step in result.steps)
+  def test_screenshot_changes_only(self,):
+    computer_tool = load_computer_tool(configs)
+    result = computer_tool.invoke({
+      'action': 'screenshot',
+      'screenshot': {'changes_only': True}
+    })
+    assert result.mime_type is not None
+    result = computer_tool.invoke({
+      'action': 'screenshot',
+      'screenshot': {'changes_only': True}
+    })
+    print(result.result if result.regions is None else [(region.left, region.top, region.right, region.bottom) for region in result.regions])
 
 if __name__ == "__main__":
   unittest.main()
@@ -3,6 +3,7 @@
 import sys
 from os.path import join, exists, dirname, abspath
 import unittest
+import asyncio
 
 sys.path.append(abspath(join(dirname(__file__), '..')))
 
@@ -63,6 +64,27 @@ class TestFileManagement(unittest.TestCase):
       }
     })
     print(result)
+  def test_search_file_pagination(self,):
+    file_tool = load_file_management_tool(configs)
+    for i in range(5):
+      result = file_tool.invoke({
+        'action': 'write_file',
+        "write_file": {
+          "file_path": f"page/test{i}.txt",
+          "text": "test abc"
+        }
+      })
+    result = file_tool.invoke({
+      'action': 'file_search',
+      'file_search': {
+        'dir_path': 'page',
+        'pattern': 'test*.txt',
+        'offset': 2,
+        'limit': 2
+      }
+    })
+    print(result)
+    assert result.result.splitlines()[:2] == ['test2.txt', 'test3.txt']
   def test_list_dir(self,):
     file_tool = load_file_management_tool(configs)
     result = file_tool.invoke({
@@ -115,6 +137,112 @@ class TestFileManagement(unittest.TestCase):
       }
     })
     print(result)
+  def test_read_file_lines(self,):
+    file_tool = load_file_management_tool(configs)
+    result = file_tool.invoke({
+      'action': 'write_file',
+      "write_file": {
+        "file_path": "lines.txt",
+        "text": "\n".join(f"line {i}" for i in range(1, 5001)) + "\n"
+      }
+    })
+    print(result)
+    result = file_tool.invoke({
+      'action': 'read_file',
+      'read_file': {
+        'file_path': 'lines.txt',
+        'start_line': 2000,
+        'num_lines': 2
+      }
+    })
+    print(result)
+    assert result.result == "line 2000\nline 2001\n"
+    result = file_tool.invoke({
+      'action': 'read_file',
+      'read_file': {
+        'file_path': 'lines.txt',
+        'tail': 1
+      }
+    })
+    print(result)
+    assert result.result == "line 5000\n"
+    # a huge tail is bounded by the read size limit like the other ranged reads
+    file_tool.max_read_bytes = 100
+    result = file_tool.invoke({
+      'action': 'read_file',
+      'read_file': {
+        'file_path': 'lines.txt',
+        'tail': 10**9
+      }
+    })
+    assert len(result.result) <= 100 and result.result.endswith("line 5000\n")
+  def test_batch(self,):
+    file_tool = load_file_management_tool(configs)
+    operations = [{'action': 'write_file', 'write_file': {'file_path': f'batch/test{i}.txt', 'text': f'test {i}'}} for i in range(10)]
+    operations.append({'action': 'read_file', 'read_file': {'file_path': 'batch/test3.txt'}})
+    operations.append({'action': 'read_file', 'read_file': {'file_path': 'batch/missing.txt'}})
+    result = file_tool.invoke({
+      'action': 'batch',
+      'batch': {
+        'operations': operations,
+        'stop_on_error': False,
+        'parallel': True
+      }
+    })
+    print(result)
+    assert result.results[10].result == 'test 3'
+    assert result.results[11].success == False
+    # success comes from the operation, not from the text of its result
+    file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': 'batch/log.txt', 'text': 'Error: disk full'}})
+    result = file_tool.invoke({
+      'action': 'batch',
+      'batch': {
+        'operations': [{'action': 'read_file', 'read_file': {'file_path': 'batch/log.txt'}}, {'action': 'list_directory', 'list_directory': {'dir_path': 'batch/missing'}}]
+      }
+    })
+    print(result)
+    assert result.results[0].success == True and result.results[0].result == 'Error: disk full'
+    assert result.results[1].success == False
+  def test_grep_content(self,):
+    file_tool = load_file_management_tool(configs)
+    file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': 'grep/.gitignore', 'text': 'ignored/\n'}})
+    file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': 'grep/code.py', 'text': 'import os\ndef find_needle():\n  return 1\n'}})
+    file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': 'grep/ignored/code.py', 'text': 'def find_needle():\n'}})
+    result = file_tool.invoke({
+      'action': 'grep_content',
+      'grep_content': {
+        'pattern': 'def \\w+_needle',
+        'dir_path': 'grep',
+        'file_pattern': '*.py',
+        'context': 1
+      }
+    })
+    print(result)
+    assert result.result == "code.py-1-import os\ncode.py:2:def find_needle():\ncode.py-3-  return 1"
+  def test_grep_content_lines(self,):
+    file_tool = load_file_management_tool(configs)
+    file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': 'grep_lines/a.txt', 'text': 'foo\nbar foo\nfoo bar\nbaz\n'}})
+    def grep(pattern, context = 0):
+      result = file_tool.invoke({'action': 'grep_content', 'grep_content': {'pattern': pattern, 'dir_path': 'grep_lines', 'context': context}})
+      print(result)
+      return result.result
+    # anchors apply to every line
+    assert grep('^foo') == "a.txt:1:foo\na.txt:3:foo bar"
+    assert grep('foo$') == "a.txt:1:foo\na.txt:2:bar foo"
+    # a match never spans lines
+    assert grep('foo\\sbar') == "a.txt:3:foo bar"
+    assert grep('^$').startswith("No matches found")
+    # overlapping context windows print each line once
+    assert grep('foo', context = 1) == "a.txt:1:foo\na.txt:2:bar foo\na.txt:3:foo bar\na.txt-4-baz"
+  def test_async_read_file(self,):
+    file_tool = load_file_management_tool(configs)
+    for i in range(4):
+      file_tool.invoke({'action': 'write_file', 'write_file': {'file_path': f'async/test{i}.txt', 'text': f'test {i}'}})
+    async def read_all():
+      return await asyncio.gather(*[file_tool.ainvoke({'action': 'read_file', 'read_file': {'file_path': f'async/test{i}.txt'}}) for i in range(4)])
+    results = asyncio.run(read_all())
+    print(results)
+    assert [result.result for result in results] == [f'test {i}' for i in range(4)]
   def test_write_file(self,):
     file_tool = load_file_management_tool(configs)
     result = file_tool.invoke({
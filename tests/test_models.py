@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+import sys
+from os.path import join, exists, dirname, abspath
+import unittest
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(abspath(join(dirname(__file__), '..')))
+
+from models import LLM, VLM
+from llm_cache import ResponseCache, MemoryBackend
+from prompt import Prompt
+from messages import SystemMessage, HumanMessage
+import configs
+
+class StubServer(object):
+  # a local openai compatible server answering every chat completion with the last user text, streamed
+  # word by word when asked to. status codes queued in errors are answered first, one per request
+  def __init__(self, delay = 0.1):
+    self.delay = delay
+    self.requests = list()
+    self.connections = set()
+    self.errors = list()
+    self.active = 0
+    self.peak = 0
+    self.lock = threading.Lock()
+    stub = self
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        stub.requests.append(body)
+        stub.connections.add(self.client_address)
+        content = body['messages'][-1]['content']
+        text = content if type(content) is str else content[0]['text']
+        with stub.lock:
+          status = stub.errors.pop(0) if len(stub.errors) else 200
+        if status != 200:
+          data = json.dumps({'error': {'message': f'stub error {status}', 'type': 'stub', 'code': status}}).encode('utf-8')
+          self.send_response(status)
+          self.send_header('Content-Type', 'application/json')
+          self.send_header('Content-Length', str(len(data)))
+          if status == 429: self.send_header('Retry-After', '0.05')
+          self.end_headers()
+          self.wfile.write(data)
+          return
+        if body.get('stream'):
+          self.send_response(200)
+          self.send_header('Content-Type', 'text/event-stream')
+          self.send_header('Connection', 'close')
+          self.end_headers()
+          for word in f'echo {text}'.split(' '):
+            time.sleep(stub.delay)
+            chunk = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'], 'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+          self.wfile.write(b'data: [DONE]\n\n')
+          self.close_connection = True
+          return
+        with stub.lock:
+          stub.active += 1
+          stub.peak = max(stub.peak, stub.active)
+        time.sleep(stub.delay)
+        with stub.lock:
+          stub.active -= 1
+        data = json.dumps({
+          'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+          'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': f'echo {text}'}}],
+          'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+      def log_message(self, *args):
+        pass
+    class Server(ThreadingHTTPServer):
+      # the default backlog of 5 drops bursts of concurrent connections
+      request_queue_size = 128
+      daemon_threads = True
+    self.server = Server(('127.0.0.1', 0), Handler)
+    self.url = f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+    threading.Thread(target = self.server.serve_forever, daemon = True).start()
+  def close(self):
+    self.server.shutdown()
+
+def stub_configs(url, **kwargs):
+  attrs = {key: value for key, value in vars(configs).items() if not key.startswith('__')}
+  attrs.update(dashscope_url = url, dashscope_key = 'stub', **kwargs)
+  return type('configs', (object,), attrs)
+
+class TestModels(unittest.TestCase):
+  def setUp(self,):
+    self.stub = StubServer()
+  def tearDown(self,):
+    self.stub.close()
+  def test_vlm_cache(self,):
+    vlm = VLM(stub_configs(self.stub.url, llm_cache = 'memory'))
+    prompt = Prompt([SystemMessage('you are a helpful assistant'), HumanMessage('what is on the screen?')])
+    results = [vlm.inference(prompt) for i in range(3)]
+    print(results)
+    assert results == ['echo what is on the screen?'] * 3 and len(self.stub.requests) == 1
+    # sampled requests go upstream every time
+    vlm.inference(prompt, temperature = 0.7)
+    vlm.inference(prompt, temperature = 0.7)
+    assert len(self.stub.requests) == 3
+  def test_vlm_cache_inflight(self,):
+    vlm = VLM(stub_configs(self.stub.url, llm_cache = 'memory'))
+    prompt = Prompt([HumanMessage('same question')])
+    results = [None] * 8
+    def ask(i):
+      results[i] = vlm.inference(prompt)
+    threads = [threading.Thread(target = ask, args = (i,)) for i in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    print(results)
+    assert results == ['echo same question'] * 8 and len(self.stub.requests) == 1
+  def test_vlm_cache_sqlite(self,):
+    path = join(tempfile.mkdtemp(), 'cache.sqlite3')
+    prompt = Prompt([HumanMessage('persisted question')])
+    VLM(stub_configs(self.stub.url, llm_cache = 'sqlite', llm_cache_path = path)).inference(prompt)
+    result = VLM(stub_configs(self.stub.url, llm_cache = 'sqlite', llm_cache_path = path)).inference(prompt)
+    assert result == 'echo persisted question' and len(self.stub.requests) == 1
+    VLM(stub_configs(self.stub.url, llm_cache = 'sqlite', llm_cache_path = path, llm_cache_ttl = 0)).inference(prompt)
+    assert len(self.stub.requests) == 2
+  def test_vlm_cache_sqlite_async(self,):
+    path = join(tempfile.mkdtemp(), 'cache.sqlite3')
+    vlm = VLM(stub_configs(self.stub.url, llm_cache = 'sqlite', llm_cache_path = path))
+    prompts = [Prompt([HumanMessage(f'persisted question {i % 2}')]) for i in range(4)]
+    async def ask():
+      return await asyncio.gather(*[vlm.ainference(prompt) for prompt in prompts])
+    results = asyncio.run(ask()) + asyncio.run(ask())
+    assert results == [f'echo persisted question {i % 2}' for i in range(4)] * 2 and len(self.stub.requests) == 2
+  def test_cache_inflight_cancel(self,):
+    cache = ResponseCache(MemoryBackend())
+    async def compute():
+      await asyncio.sleep(0.2)
+      return 'answer'
+    async def ask():
+      owner = asyncio.ensure_future(cache.aget_or_compute([], {}, compute))
+      await asyncio.sleep(0.01)
+      waiters = [asyncio.ensure_future(cache.aget_or_compute([], {}, compute)) for i in range(2)]
+      await asyncio.sleep(0.01)
+      # a waiter giving up does not affect the owner or the other waiters
+      waiters[0].cancel()
+      return await asyncio.gather(owner, waiters[1], waiters[0], return_exceptions = True)
+    results = asyncio.run(ask())
+    print(results)
+    assert results[:2] == ['answer', 'answer'] and isinstance(results[2], asyncio.CancelledError)
+  def test_vlm_stream(self,):
+    vlm = VLM(stub_configs(self.stub.url))
+    prompt = Prompt([HumanMessage('one two three four five')])
+    start = time.time()
+    chunks = list()
+    for chunk in vlm.stream_inference(prompt):
+      if len(chunks) == 0: first = time.time() - start
+      chunks.append(chunk)
+    total = time.time() - start
+    print(f'time to first token {first:.3f}s, total {total:.3f}s')
+    assert ''.join(chunks) == 'echo one two three four five ' and first < total / 2
+  def test_vlm_async(self,):
+    vlm = VLM(stub_configs(self.stub.url))
+    prompts = [Prompt([HumanMessage(f'question {i}')]) for i in range(4)]
+    async def ask():
+      results = await asyncio.gather(*[vlm.ainference(prompt) for prompt in prompts])
+      chunks = [chunk async for chunk in vlm.astream_inference(prompts[0])]
+      return results, chunks
+    start = time.time()
+    results, chunks = asyncio.run(ask())
+    print(results, chunks, time.time() - start)
+    assert results == [f'echo question {i}' for i in range(4)] and ''.join(chunks) == 'echo question 0 '
+  def test_vlm_keepalive(self,):
+    vlm = VLM(stub_configs(self.stub.url))
+    for i in range(5):
+      vlm.inference(Prompt([HumanMessage(f'question {i}')]))
+    # sequential requests reuse one pooled connection
+    assert len(self.stub.connections) == 1
+  def test_vlm_batch(self,):
+    vlm = VLM(stub_configs(self.stub.url, llm_retry_base_delay = 0.01))
+    self.stub.errors.extend([429, 503, 429])
+    prompts = [Prompt([HumanMessage(f'question {i}')]) for i in range(6)]
+    results = vlm.batch_inference(prompts, max_concurrency = 2)
+    print(results)
+    assert [result.text for result in results] == [f'echo question {i}' for i in range(6)]
+    assert sum(result.attempts for result in results) == 6 + 3
+    # client errors are not retried and only fail their own prompt
+    self.stub.errors.extend([400])
+    results = vlm.batch_inference(prompts[:3], max_concurrency = 1)
+    print(results)
+    assert results[0].success == False and results[0].attempts == 1 and [result.text for result in results[1:]] == ['echo question 1', 'echo question 2']
+  def test_vlm_batch_throughput(self,):
+    vlm = VLM(stub_configs(self.stub.url))
+    prompts = [Prompt([HumanMessage(f'question {i}')]) for i in range(32)]
+    elapsed = dict()
+    for max_concurrency in [1, 4, 16]:
+      start = time.time()
+      results = vlm.batch_inference(prompts, max_concurrency = max_concurrency)
+      elapsed[max_concurrency] = time.time() - start
+      print(f'concurrency {max_concurrency}: {len(prompts) / elapsed[max_concurrency]:.1f} requests/s, peak {self.stub.peak}')
+      assert all(result.success for result in results) and self.stub.peak <= max_concurrency
+      self.stub.peak = 0
+    assert elapsed[16] * 4 < elapsed[1]
+  def test_vlm_batch_reuse(self,):
+    vlm = VLM(stub_configs(self.stub.url))
+    prompts = [Prompt([HumanMessage(f'question {i}')]) for i in range(4)]
+    for i in range(5):
+      vlm.batch_inference(prompts, max_concurrency = 2)
+    # sync batches share one loop, so its keep-alive connections outlive each call
+    assert len(self.stub.connections) <= 2
+    for i in range(5):
+      asyncio.run(vlm.ainference(prompts[0]))
+    # clients of loops closed by asyncio.run are dropped instead of accumulating
+    assert len(vlm.async_clients) <= 2
+  def test_llm_cache(self,):
+    # the llm samples with temperature 0.7, so only a forced cache serves repeated prompts
+    llm = LLM(stub_configs(self.stub.url, llm_cache = 'memory'))
+    llm.invoke('hello'); llm.invoke('hello')
+    assert len(self.stub.requests) == 2
+    llm = LLM(stub_configs(self.stub.url, llm_cache = 'memory', llm_cache_force = True))
+    results = [llm.invoke('hello').content for i in range(2)]
+    async def ainvoke_all():
+      return await asyncio.gather(*[llm.ainvoke('async hello') for i in range(4)])
+    aresults = [message.content for message in asyncio.run(ainvoke_all())]
+    print(results, aresults)
+    assert results == ['echo hello'] * 2 and aresults == ['echo async hello'] * 4 and len(self.stub.requests) == 4
+
+if __name__ == "__main__":
+  unittest.main()
@@ -2,6 +2,7 @@
 
 import sys
 import time
+import asyncio
 from os.path import join, exists, dirname, abspath
 import unittest
 
@@ -20,7 +21,137 @@ class TestShell(unittest.TestCase):
         'blocking': True
       }
     })
+    print(result.output, result.exit_code)
+  def test_long_command(self,):
+    shell_tool = load_shell_tool(configs)
+    # the echo of a command wider than the pane is wrapped and redrawn by the terminal
+    command = 'echo ' + ' '.join(f'word{i}' for i in range(60)) + ' && echo done'
+    result = shell_tool.invoke({
+      'action': 'execute_command',
+      'execute_command': {
+        'command': command,
+        'blocking': True
+      }
+    })
+    print(result.output, result.exit_code)
+    assert result.exit_code == 0 and 'word59\ndone' in result.output
+    assert 'status' not in result.output and 'wait-for' not in result.output
+  def test_long_output(self,):
+    shell_tool = load_shell_tool(configs)
+    shell_tool.max_read_bytes = 1000
+    result = shell_tool.invoke({
+      'action': 'execute_command',
+      'execute_command': {
+        'command': 'seq 1 2000',
+        'blocking': True
+      }
+    })
+    # the output is returned in pages, the session is kept until all of it can be read
+    assert result.completed and result.exit_code == 0 and len(result.output) < 1100 and f'offset {result.offset}' in result.output
+    pages, lines = 1, result.output.splitlines()[:-1]
+    while 'use check_command_output with offset' in result.output:
+      result = shell_tool.invoke({
+        'action': 'check_command_output',
+        'check_command_output': {
+          'session_name': result.session_name,
+          'offset': result.offset
+        }
+      })
+      pages += 1
+      lines += [line for line in result.output.splitlines() if not line.startswith('...')]
+    print(pages)
+    assert pages > 5 and [str(i) for i in range(1, 2001)] == [line for line in lines if line.isdigit()]
+    result = shell_tool.invoke({
+      'action': 'check_command_output',
+      'check_command_output': {
+        'session_name': result.session_name,
+        'tail': 3
+      }
+    })
     print(result.output)
+    assert '1999\n2000' in result.output and len(result.output) < 100
+    shell_tool.invoke({'action': 'terminate_command', 'terminate_command': {'session_name': result.session_name}})
+  def test_async_execute_command(self,):
+    shell_tool = load_shell_tool(configs)
+    async def execute(i):
+      return await shell_tool.ainvoke({
+        'action': 'execute_command',
+        'execute_command': {
+          'command': f'sleep 1; echo "job {i}"',
+          'blocking': True
+        }
+      })
+    async def execute_all():
+      return await asyncio.gather(*[execute(i) for i in range(4)])
+    results = asyncio.run(execute_all())
+    for result in results:
+      print(result.output, result.exit_code)
+      assert result.completed
+  def test_control_mode(self,):
+    configs.shell_control_mode = True
+    try:
+      shell_tool = load_shell_tool(configs)
+      result = shell_tool.invoke({
+        'action': 'execute_command',
+        'execute_command': {
+          'command': 'echo "control mode"',
+          'blocking': True
+        }
+      })
+      print(result.output, result.exit_code)
+      assert result.completed and result.exit_code == 0
+      shell_tool.config.server.close()
+    finally:
+      configs.shell_control_mode = False
+  def test_session_pool(self,):
+    configs.shell_pool_size, configs.shell_pool_reuse = 2, True
+    try:
+      shell_tool = load_shell_tool(configs)
+      time.sleep(5)
+      for i in range(3):
+        start_time = time.time()
+        result = shell_tool.invoke({
+          'action': 'execute_command',
+          'execute_command': {
+            'command': 'echo $$',
+            'blocking': True
+          }
+        })
+        print(result.output, time.time() - start_time)
+        assert result.completed
+      # a reused session starts from a fresh shell in the workspace
+      for command in ['cd / ; export POOLED=1', 'echo "pooled=$POOLED" ; pwd']:
+        time.sleep(1)
+        result = shell_tool.invoke({
+          'action': 'execute_command',
+          'execute_command': {
+            'command': command,
+            'blocking': True
+          }
+        })
+      print(result.output)
+      assert 'pooled=\n' in result.output and abspath(configs.workspace_dir) in result.output
+      # the folder of a command is resolved against the workspace, not against the cwd of the pooled shell
+      time.sleep(1)
+      result = shell_tool.invoke({
+        'action': 'execute_command',
+        'execute_command': {
+          'command': 'pwd',
+          'folder': 'pooled',
+          'blocking': True
+        }
+      })
+      print(result.output)
+      assert join(abspath(configs.workspace_dir), 'pooled') in result.output and 'No such file' not in result.output
+      # closing kills the idle pooled sessions and removes the state directory
+      time.sleep(1)
+      pooled = list(shell_tool.config.pool)
+      assert len(pooled) > 0
+      shell_tool.close()
+      sessions = [session.session_name for session in shell_tool.config.server.sessions]
+      assert not any(name in sessions for name in pooled) and not exists(shell_tool.config.state_dir)
+    finally:
+      configs.shell_pool_size, configs.shell_pool_reuse = 0, False
   def test_check_command_output(self,):
     shell_tool = load_shell_tool(configs)
     result = shell_tool.invoke({
@@ -45,6 +176,27 @@ done""",
       }
     })
     print(result.output, result.completed)
+  def test_stream_output(self,):
+    shell_tool = load_shell_tool(configs)
+    result = shell_tool.invoke({
+      'action': 'execute_command',
+      'execute_command': {
+        'command': 'for i in 1 2 3; do echo "line $i"; sleep 1; done',
+        'blocking': False
+      }
+    })
+    assert result.session_name is not None
+    for chunk in shell_tool.stream_output(result.session_name):
+      print(chunk.output, chunk.offset)
+    assert chunk.completed and chunk.exit_code == 0
+    result = shell_tool.invoke({
+      'action': 'check_command_output',
+      'check_command_output': {
+        'session_name': result.session_name,
+        'offset': chunk.offset
+      }
+    })
+    assert result.output == ''
   def test_terminate_command(self,):
     shell_tool = load_shell_tool(configs)
     result = shell_tool.invoke({
@@ -7,6 +7,7 @@ import unittest
 sys.path.append(abspath(join(dirname(__file__), '..')))
 
 import base64
+import asyncio
 from tools import load_see_image_tool
 import configs
 
@@ -17,6 +18,29 @@ class TestSeeImage(unittest.TestCase):
     img_bytes = base64.b64decode(result.base64.encode('utf-8'))
     with open('test2.png', 'wb') as f:
       f.write(img_bytes)
+  def test_see_image_passthrough(self,):
+    see_image_tool = load_see_image_tool(configs)
+    result = see_image_tool.invoke({'file_path': 'test.png'})
+    with open('test.png', 'rb') as f:
+      assert base64.b64decode(result.base64.encode('utf-8')) == f.read()
+  def test_see_image_region(self,):
+    see_image_tool = load_see_image_tool(configs)
+    result = see_image_tool.invoke({'file_path': 'test.png', 'region': [0, 0, 200, 200], 'max_tokens': 16})
+    img_bytes = base64.b64decode(result.base64.encode('utf-8'))
+    with open('test3.png', 'wb') as f:
+      f.write(img_bytes)
+  def test_see_image_cache(self,):
+    see_image_tool = load_see_image_tool(configs)
+    result = see_image_tool.invoke({'file_path': 'test.png'})
+    cached = see_image_tool.invoke({'file_path': 'test.png'})
+    assert result.base64 == cached.base64
+    assert len(see_image_tool.config.cache.entries) == 1
+  def test_async_see_image(self,):
+    see_image_tool = load_see_image_tool(configs)
+    async def see_all():
+      return await asyncio.gather(*[see_image_tool.ainvoke({'file_path': 'test.png'}) for i in range(4)])
+    results = asyncio.run(see_all())
+    assert len(set(result.base64 for result in results)) == 1
 
 if __name__ == "__main__":
   unittest.main()
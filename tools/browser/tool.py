@@ -1,51 +1,398 @@
 #!/usr/bin/python3
 
+import os
 import asyncio
-from typing import Type, List, Optional, Annotated, Literal, Union
-from pydantic import BaseModel, Field, validator, root_validator
+import atexit
+import base64
+import json
+import platform
+from glob import glob
+from os import listdir, makedirs
+from os.path import join, exists, isdir, isfile, basename, dirname, realpath, getmtime, expanduser
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import aiohttp
+from typing import Type, List, Optional, Annotated, Literal, Union, Any
+from pydantic import BaseModel, Field, validator, root_validator, model_validator
 from langchain_core.tools.structured import StructuredTool
 from langchain_core.callbacks.manager import CallbackManagerForToolRun
-from browser_use import Agent, ChatOpenAI
+from browser_use import Agent, ChatOpenAI, BrowserSession
+from browser_use.browser.profile import BrowserProfile
+from background import BackgroundLoop
+
+def find_browser():
+  # the newest chromium installed by playwright, then a chrome or chromium of the system
+  if platform.system() == 'Darwin':
+    playwright_path = os.environ.get('PLAYWRIGHT_BROWSERS_PATH') or expanduser('~/Library/Caches/ms-playwright')
+    patterns = [join(playwright_path, 'chromium-*', 'chrome-mac*', 'Chromium.app', 'Contents', 'MacOS', 'Chromium'),
+                '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome', '/Applications/Chromium.app/Contents/MacOS/Chromium']
+  else:
+    playwright_path = os.environ.get('PLAYWRIGHT_BROWSERS_PATH') or expanduser('~/.cache/ms-playwright')
+    patterns = [join(playwright_path, 'chromium-*', 'chrome-linux*', 'chrome')]
+  for pattern in patterns:
+    matches = [path for path in sorted(glob(pattern)) if isfile(path)]
+    if len(matches): return matches[-1]
+  for name in ['google-chrome-stable', 'google-chrome', 'chromium', 'chromium-browser']:
+    path = shutil.which(name)
+    if path is not None: return path
+  return None
+
+class PooledBrowser(object):
+  # a chromium process launched with a remote debugging port, agents attach to it over CDP
+  def __init__(self, process, cdp_url, user_data_dir):
+    self.process = process
+    self.cdp_url = cdp_url
+    self.user_data_dir = user_data_dir
+    self.last_used = time.monotonic()
+  async def healthy(self, timeout = 2):
+    if self.process.poll() is not None:
+      return False
+    try:
+      async with aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = timeout)) as session:
+        async with session.get(self.cdp_url.rstrip('/') + '/json/version') as resp:
+          return resp.status == 200
+    except Exception:
+      return False
+  def close(self):
+    if self.process.poll() is None:
+      self.process.terminate()
+      try:
+        self.process.wait(timeout = 5)
+      except subprocess.TimeoutExpired:
+        self.process.kill()
+        self.process.wait()
+    shutil.rmtree(self.user_data_dir, ignore_errors = True)
+
+class BrowserPool(object):
+  # warm browsers shared across tool calls. at most size browsers are in use at once, browsers idle for longer
+  # than idle_timeout are shut down, and every browser is health checked before it is handed out
+  def __init__(self, size = 2, idle_timeout = 300, headless = True, executable_path = None, launch_timeout = 30):
+    self.size = size
+    self.idle_timeout = idle_timeout
+    self.headless = headless
+    self.executable_path = executable_path
+    self.launch_timeout = launch_timeout
+    self.idle = list()
+    self.lock = threading.Lock()
+    self.slots = threading.BoundedSemaphore(size)
+  async def launch(self):
+    user_data_dir = tempfile.mkdtemp(prefix = 'browser-pool-')
+    try:
+      profile = BrowserProfile(headless = self.headless, user_data_dir = user_data_dir)
+      executable_path = self.executable_path or find_browser()
+      if executable_path is None:
+        raise RuntimeError('no chromium executable found, install one with `playwright install chromium`!')
+      # port 0 lets chromium pick a free port itself, which it writes to DevToolsActivePort in the profile
+      process = subprocess.Popen([executable_path, *profile.get_args(), '--remote-debugging-port=0'], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    except Exception:
+      shutil.rmtree(user_data_dir, ignore_errors = True)
+      raise
+    browser = PooledBrowser(process, None, user_data_dir)
+    try:
+      await self.wait_ready(browser)
+    except BaseException:
+      await asyncio.to_thread(browser.close)
+      raise
+    return browser
+  async def wait_ready(self, browser):
+    port_path = join(browser.user_data_dir, 'DevToolsActivePort')
+    deadline = time.monotonic() + self.launch_timeout
+    while time.monotonic() < deadline:
+      if browser.process.poll() is not None:
+        raise RuntimeError(f'chromium exited with code {browser.process.returncode} before its debugging port was ready!')
+      if browser.cdp_url is None and exists(port_path):
+        with open(port_path, 'r') as f:
+          port = f.readline().strip()
+        if port.isdigit(): browser.cdp_url = f'http://127.0.0.1:{port}/'
+      if browser.cdp_url is not None and await browser.healthy(timeout = 1):
+        return
+      await asyncio.sleep(0.1)
+    raise TimeoutError(f'chromium did not open its debugging port within {self.launch_timeout} seconds!')
+  async def evict(self):
+    now = time.monotonic()
+    with self.lock:
+      expired = [browser for browser in self.idle if now - browser.last_used > self.idle_timeout]
+      self.idle = [browser for browser in self.idle if now - browser.last_used <= self.idle_timeout]
+    # closing waits for the process to exit, which must not stall the shared loop
+    for browser in expired:
+      await asyncio.to_thread(browser.close)
+  async def acquire(self):
+    # poll instead of blocking so that waiting callers stay cancellable and do not pin an event loop
+    while not self.slots.acquire(blocking = False):
+      await asyncio.sleep(0.05)
+    try:
+      await self.evict()
+      while True:
+        with self.lock:
+          browser = self.idle.pop() if len(self.idle) else None
+        if browser is None:
+          return await self.launch()
+        if await browser.healthy():
+          return browser
+        await asyncio.to_thread(browser.close)
+    except BaseException:
+      self.slots.release()
+      raise
+  async def release(self, browser, broken = False):
+    try:
+      if broken or browser.process.poll() is not None:
+        await asyncio.to_thread(browser.close)
+      else:
+        browser.last_used = time.monotonic()
+        with self.lock:
+          self.idle.append(browser)
+    finally:
+      self.slots.release()
+    await self.evict()
+  async def scrub(self, session, urls = ()):
+    # isolate the next task: clear the storage of every origin the task visited, including tabs it already closed,
+    # then cookies and the http cache of the whole profile, and leave a single blank tab
+    client = session.cdp_client
+    targets = (await client.send.Target.getTargets())['targetInfos']
+    pages = [target for target in targets if target['type'] == 'page']
+    urls = [*urls, *(target['url'] for target in targets)]
+    origins = {'/'.join(url.split('/')[:3]) for url in urls if url and url.startswith(('http://', 'https://'))}
+    for origin in sorted(origins):
+      await client.send.Storage.clearDataForOrigin(params = {'origin': origin, 'storageTypes': 'all'})
+    await client.send.Storage.clearCookies()
+    blank = (await client.send.Target.createTarget(params = {'url': 'about:blank'}))['targetId']
+    # the http cache is cleared through a page session, it is shared by all pages of the profile
+    session_id = (await client.send.Target.attachToTarget(params = {'targetId': blank, 'flatten': True}))['sessionId']
+    try:
+      await client.send.Network.clearBrowserCache(session_id = session_id)
+    finally:
+      await client.send.Target.detachFromTarget(params = {'sessionId': session_id})
+    for target in pages:
+      await client.send.Target.closeTarget(params = {'targetId': target['targetId']})
+  def close(self):
+    with self.lock:
+      idle, self.idle = self.idle, list()
+    for browser in idle:
+      browser.close()
+
+background_loop_lock = threading.Lock()
+background_loop_instance = None
+
+def background_loop():
+  global background_loop_instance
+  with background_loop_lock:
+    if background_loop_instance is None:
+      # all browser work runs on this loop, so sessions and the http pool of the llm client outlive a single call
+      background_loop_instance = BackgroundLoop(name = 'browser-loop')
+    return background_loop_instance
+
+class BrowserHistory(object):
+  # the history of a run saved as json in its run directory next to its screenshots, steps and screenshots are only loaded on demand
+  def __init__(self, path):
+    self.path = path
+  def relocate(self, path):
+    # screenshots are read from the screenshots directory of the run whatever absolute path the json recorded
+    return join(dirname(self.path), 'screenshots', basename(path)) if path else None
+  def load(self):
+    with open(self.path, 'r', encoding = 'utf-8') as f:
+      return json.load(f)['history']
+  def __len__(self):
+    return len(self.load())
+  @staticmethod
+  def compact(index, step):
+    state = step.get('state') or {}
+    results = step.get('result') or []
+    return {
+      'step': index,
+      'url': state.get('url'),
+      'title': state.get('title'),
+      'actions': (step.get('model_output') or {}).get('action', []),
+      'extracted_content': [result['extracted_content'] for result in results if result.get('extracted_content')],
+      'errors': [result['error'] for result in results if result.get('error')],
+      'screenshot_path': state.get('screenshot_path')
+    }
+  def steps(self, offset = 0, limit = 10):
+    history = self.load()
+    steps = [self.compact(index, step) for index, step in enumerate(history[offset:offset + limit], offset)]
+    for step in steps:
+      step['screenshot_path'] = self.relocate(step['screenshot_path'])
+    return len(history), steps
+  def extracted_content(self, offset = 0, limit = 10):
+    content = [result['extracted_content'] for step in self.load() for result in step.get('result') or [] if result.get('extracted_content')]
+    return len(content), content[offset:offset + limit]
+  def screenshot_paths(self):
+    return [self.relocate((step.get('state') or {}).get('screenshot_path')) for step in self.load() if (step.get('state') or {}).get('screenshot_path')]
+  def screenshots(self, offset = 0, limit = 1):
+    paths = self.screenshot_paths()
+    screenshots = list()
+    for path in paths[offset:offset + limit]:
+      with open(path, 'rb') as f:
+        screenshots.append(base64.b64encode(f.read()).decode('utf-8'))
+    return len(paths), screenshots
+
+class HistoryStore(object):
+  # one directory per run holding history.json and the screenshots of the run. only histories in here can be read,
+  # runs older than ttl seconds and the oldest beyond max_runs are deleted whenever a run is saved
+  def __init__(self, directory, ttl = None, max_runs = None):
+    self.directory = realpath(directory)
+    self.ttl = ttl
+    self.max_runs = max_runs
+    self.lock = threading.Lock()
+  def save(self, history_list, agent_directory):
+    with self.lock:
+      makedirs(self.directory, exist_ok = True)
+      run_directory = join(self.directory, basename(agent_directory))
+      if exists(agent_directory):
+        shutil.move(str(agent_directory), run_directory)
+      else:
+        makedirs(run_directory, exist_ok = True)
+      path = join(run_directory, 'history.json')
+      history_list.save_to_file(path)
+      self.cleanup(keep = run_directory)
+    return BrowserHistory(path)
+  def open(self, history_path):
+    path = realpath(history_path)
+    if dirname(dirname(path)) != self.directory or basename(path) != 'history.json' or not exists(path):
+      raise ValueError(f"{history_path} is not the history_path of a browser run, or the run was cleaned up!")
+    return BrowserHistory(path)
+  def cleanup(self, keep = None):
+    now = time.time()
+    runs = sorted([join(self.directory, name) for name in listdir(self.directory) if isdir(join(self.directory, name))], key = getmtime, reverse = True)
+    expired = [run for index, run in enumerate(runs) if (self.ttl is not None and now - getmtime(run) > self.ttl) or (self.max_runs is not None and index >= self.max_runs)]
+    for run in expired:
+      if run != keep:
+        shutil.rmtree(run, ignore_errors = True)
 
 def load_browser_tool(configs):
+  class HistoryPage(BaseModel):
+    history_path: str = Field(description = "history_path of a previous browser result")
+    content: Literal['steps', 'extracted_content', 'screenshots'] = Field('steps', description = "what to read from the history, screenshots are returned as base64 images")
+    offset: int = Field(0, description = "index of the first item to return", ge = 0)
+    limit: int = Field(10, description = "maximum number of items to return", ge = 1, le = 50)
   class BrowserInput(BaseModel):
-    query: str = Field(description = "a task to assign to a browser agent in natural language")
+    query: Optional[str] = Field(None, description = "a task to assign to a browser agent in natural language")
+    queries: Optional[List[str]] = Field(None, description = "independent tasks to run concurrently, each in its own browser. use instead of query for several lookups")
+    timeout: Optional[float] = Field(None, description = "Optional time limit in seconds for each task. Defaults to the configured limit.", gt = 0)
+    history: Optional[HistoryPage] = Field(None, description = "read a page of the steps, extracted content or screenshots of a previous run instead of browsing")
+    @model_validator(mode = "after")
+    @classmethod
+    def require_query(cls, self):
+      if [self.query, self.queries, self.history].count(None) != 2:
+        raise ValueError("exactly one of query, queries and history must be provided")
+      if self.queries is not None and len(self.queries) == 0:
+        raise ValueError("queries must not be empty")
+      return self
   class BrowserOutput(BaseModel):
     is_done: bool = Field(description = "whether browser agent is done")
     is_successful: bool = Field(description = "whether browser agent complete task successfully")
     has_errors: bool = Field(description = "wether agent has any non-None errors")
     answer: str = Field(description = "the answer in text")
-    screenshot_path: str = Field(description = "the path to the image of the last browser screenshot")
+    screenshot_path: Optional[str] = Field(None, description = "the path to the image of the last browser screenshot")
+    steps: int = Field(0, description = "number of steps the browser agent took")
+    error: Optional[str] = Field(None, description = "the last error of the browser agent if any")
+    history_path: Optional[str] = Field(None, description = "the path to the saved run history, pass it in history to read steps, extracted content or screenshots")
+  class BrowserBatchOutput(BaseModel):
+    results: List[BrowserOutput] = Field(description = "one result per task, in the order of queries")
+  class BrowserHistoryOutput(BaseModel):
+    total: int = Field(description = "total number of items of this content in the history")
+    items: List[Any] = Field(description = "the requested page of items")
   class BrowserConfig(BaseModel):
     class Config:
       arbitrary_types_allowed = True
     llm: ChatOpenAI
+    pool: BrowserPool
+    loop: BackgroundLoop
+    max_concurrency: int
+    task_timeout: Optional[float]
+    history: HistoryStore
   class BrowserTool(StructuredTool):
     name: str = "browser"
-    description: str = "a tool to execute web task. Input should be a natural language task like 'find out which country leads medal table of winter olympic games 2026'."
+    description: str = "a tool to execute web task. Input should be a natural language task like 'find out which country leads medal table of winter olympic games 2026'. Several independent tasks can be given as queries and run concurrently."
     args_schema: Type[BaseModel] = BrowserInput
     config: BrowserConfig
-    async def _arun(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None):
-      agent = Agent(
-        task = query,
-        llm = self.config.llm
-      )
-      history_list = await agent.run()
-
-      is_done = history_list.is_done()
-      is_successful = history_list.is_successful()
-      has_errors = history_list.has_errors()
-      extracted = history_list.extracted_content() # List[str]
-      screenshot_paths = history_list.screenshot_paths() # List[str] image path
-      screenshots = history_list.screenshots() # List[str] image bytes base64
+    async def _browse(self, query: str):
+      browser = await self.config.pool.acquire()
+      # keep_alive stops the agent from closing the shared browser when it finishes
+      session = BrowserSession(cdp_url = browser.cdp_url, keep_alive = True)
+      broken = True
+      try:
+        agent = Agent(
+          task = query,
+          llm = self.config.llm,
+          browser_session = session
+        )
+        history_list = await agent.run()
+        try:
+          await self.config.pool.scrub(session, history_list.urls())
+          broken = False
+        except Exception:
+          # the run still has its answer, but a browser that may hold the state of this task is not reused
+          pass
+      finally:
+        try:
+          await session.reset()
+        except Exception:
+          broken = True
+        await self.config.pool.release(browser, broken = broken)
+
+      # keep the history on disk next to the screenshots and return a summary, screenshots are never loaded here
+      history = await asyncio.to_thread(self.config.history.save, history_list, agent.agent_directory)
+      extracted = history_list.extracted_content()
+      screenshot_paths = [history.relocate(path) for path in history_list.screenshot_paths(return_none_if_not_screenshot = False)]
+      errors = [error for error in history_list.errors() if error]
       return BrowserOutput(
-        is_done = is_done,
-        is_successful = is_successful,
-        has_errors = has_errors,
-        answer = extracted[-1],
-        screenshot_path = screenshot_paths[-1]
+        is_done = history_list.is_done(),
+        is_successful = history_list.is_successful() is True,
+        has_errors = history_list.has_errors(),
+        answer = history_list.final_result() or (extracted[-1] if len(extracted) else ''),
+        screenshot_path = screenshot_paths[-1] if len(screenshot_paths) else None,
+        steps = len(history_list),
+        error = errors[-1] if len(errors) else None,
+        history_path = history.path
       )
-    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None):
-      return asyncio.run(self._arun(query, run_manager = run_manager))
-  return BrowserTool(config = BrowserConfig(llm = ChatOpenAI(api_key = configs.dashscope_key, base_url = configs.dashscope_url, model = configs.dashscope_llm_model)))
+    async def _browse_limited(self, query: str, semaphore: asyncio.Semaphore, timeout: Optional[float]):
+      # a failed or slow task is reported in its own result and does not affect the other tasks
+      async with semaphore:
+        try:
+          return await asyncio.wait_for(self._browse(query), timeout)
+        except asyncio.TimeoutError:
+          return BrowserOutput(is_done = False, is_successful = False, has_errors = True, answer = f"task timed out after {timeout} seconds")
+        except Exception as e:
+          return BrowserOutput(is_done = False, is_successful = False, has_errors = True, answer = f"task failed: {e}")
+    async def astream(self, queries: List[str], timeout: Optional[float] = None):
+      # yield (index, result) pairs as the tasks finish
+      timeout = timeout or self.config.task_timeout
+      # the semaphore binds to the browser loop on first use, where all tasks run
+      semaphore = asyncio.Semaphore(self.config.max_concurrency)
+      async def indexed(index, query):
+        return index, await self.config.loop.wrap(self._browse_limited(query, semaphore, timeout))
+      tasks = [asyncio.ensure_future(indexed(index, query)) for index, query in enumerate(queries)]
+      try:
+        for future in asyncio.as_completed(tasks):
+          yield await future
+      finally:
+        for task in tasks:
+          task.cancel()
+    async def _execute(self, query: Optional[str] = None, queries: Optional[List[str]] = None, timeout: Optional[float] = None, history: Optional[HistoryPage] = None):
+      if history is not None:
+        history = HistoryPage.model_validate(history) if isinstance(history, dict) else history
+        total, items = getattr(self.config.history.open(history.history_path), history.content)(history.offset, history.limit)
+        return BrowserHistoryOutput(total = total, items = items)
+      if query is not None:
+        return await asyncio.wait_for(self._browse(query), timeout or self.config.task_timeout)
+      results = [None] * len(queries)
+      async for index, result in self.astream(queries, timeout):
+        results[index] = result
+      return BrowserBatchOutput(results = results)
+    async def _arun(self, query: Optional[str] = None, queries: Optional[List[str]] = None, timeout: Optional[float] = None, history: Optional[HistoryPage] = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+      return await self.config.loop.wrap(self._execute(query, queries, timeout, history))
+    def _run(self, query: Optional[str] = None, queries: Optional[List[str]] = None, timeout: Optional[float] = None, history: Optional[HistoryPage] = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+      return self.config.loop.run(self._execute(query, queries, timeout, history))
+  pool = BrowserPool(size = configs.browser_pool_size, idle_timeout = configs.browser_pool_idle_timeout, headless = configs.browser_headless)
+  atexit.register(pool.close)
+  return BrowserTool(config = BrowserConfig(
+    llm = ChatOpenAI(api_key = configs.dashscope_key, base_url = configs.dashscope_url, model = configs.dashscope_llm_model),
+    pool = pool,
+    loop = background_loop(),
+    max_concurrency = configs.browser_max_concurrency,
+    task_timeout = configs.browser_task_timeout,
+    history = HistoryStore(configs.browser_history_dir, ttl = configs.browser_history_ttl, max_runs = configs.browser_history_max_runs)))
 
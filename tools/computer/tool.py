@@ -1,13 +1,26 @@
 #!/usr/bin/python3
 
+import os
 import time
-import tempfile
-import base64
+import shutil
+import threading
+import subprocess
 from typing import Type, List, Optional, Annotated, Literal, Union
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, InstanceOf, model_validator
 from langchain_core.tools.structured import StructuredTool
 from langchain_core.callbacks.manager import CallbackManagerForToolRun
+import numpy as np
+from PIL import Image
 import pyautogui
+from imaging import prepare_image, target_ratio, DEFAULT_MAX_WIDTH, DEFAULT_MAX_HEIGHT
+try:
+  from Xlib import X, display as xdisplay
+except ImportError:
+  xdisplay = None
+try:
+  import pyperclip
+except ImportError:
+  pyperclip = None
 
 KEYBOARD_KEYS = [
   "a", "b", "c", "d", "e", "f", "g", "h", "i",
@@ -23,6 +36,139 @@ HOT_KEYS = ["ctrl+c", "ctrl+v", "ctrl+x",
   "ctrl+z", "ctrl+a", "ctrl+s", "alt+tab",
   "alt+f4", "ctrl+alt+delete",
 ]
+CHANGE_TILE_SIZE = 32
+MAX_CHANGED_REGIONS = 8
+MAX_CHANGED_AREA = 0.5
+FINGERPRINT_BLOCK = 16
+FINGERPRINT_TOLERANCE = 4
+
+class RegionError(ValueError):
+  pass
+
+class ScreenCapture(object):
+  # captures the screen into memory over one persistent X connection, pyautogui is the fallback without Xlib or an X server.
+  # a capture is the image and a numpy view of its pixels for diffing, previous holds the frame of the last screenshot
+  def __init__(self):
+    self.display = None
+    self.previous = None
+    self.lock = threading.Lock()
+  def _grab_x11(self, region = None):
+    if self.display is None:
+      self.display = xdisplay.Display()
+    root = self.display.screen().root
+    geometry = root.get_geometry()
+    left, top, right, bottom = clip_region(region, geometry.width, geometry.height)
+    width, height = right - left, bottom - top
+    raw = root.get_image(left, top, width, height, X.ZPixmap, 0xffffffff)
+    if len(raw.data) != width * height * 4:
+      raise RuntimeError(f"unsupported pixel format of depth {raw.depth}!")
+    img = Image.frombuffer("RGB", (width, height), raw.data, "raw", "BGRX", 0, 1)
+    return img, np.frombuffer(raw.data, dtype = np.uint8).reshape(height, width, 4)
+  def _reset(self):
+    if self.display is not None:
+      try:
+        self.display.close()
+      except Exception:
+        pass
+    self.display = None
+  def screen_size(self):
+    with self.lock:
+      if xdisplay is not None:
+        try:
+          if self.display is None:
+            self.display = xdisplay.Display()
+          geometry = self.display.screen().root.get_geometry()
+          return geometry.width, geometry.height
+        except Exception:
+          self._reset()
+      return tuple(pyautogui.size())
+  def grab(self, region = None):
+    with self.lock:
+      if xdisplay is not None:
+        try:
+          return self._grab_x11(region)
+        except RegionError:
+          # a region outside of the screen is the caller's error, the connection is fine
+          raise
+        except Exception:
+          # the connection is reopened by the next capture, this one goes through pyautogui
+          self._reset()
+      if region is not None:
+        width, height = pyautogui.size()
+        left, top, right, bottom = clip_region(region, width, height)
+        img = pyautogui.screenshot(region = (left, top, right - left, bottom - top))
+      else:
+        img = pyautogui.screenshot()
+      return img, np.asarray(img)
+
+def paste_text(text, hotkey, settle):
+  # puts the text on the clipboard, pastes it and restores the previous clipboard content.
+  # the target application fetches the clipboard asynchronously, so it is only restored after settle seconds
+  if pyperclip is None:
+    raise RuntimeError("pyperclip is not installed!")
+  try:
+    previous = pyperclip.paste()
+  except pyperclip.PyperclipException:
+    previous = None
+  pyperclip.copy(text)
+  try:
+    pyautogui.hotkey(*hotkey.split('+'))
+    time.sleep(settle)
+  finally:
+    if previous is not None:
+      pyperclip.copy(previous)
+
+def xdotool_type(text):
+  # xdotool types any unicode text through XTest by remapping a spare keycode, without a delay between characters
+  if shutil.which('xdotool') is None or not os.environ.get('DISPLAY'):
+    raise RuntimeError("xdotool or an X11 display is not available!")
+  subprocess.run(['xdotool', 'type', '--delay', '0', '--', text], check = True, capture_output = True, timeout = 10 + len(text) / 100)
+
+def clip_region(region, width, height):
+  if region is None: return 0, 0, width, height
+  left, top, right, bottom = max(region[0], 0), max(region[1], 0), min(region[2], width), min(region[3], height)
+  if left >= right or top >= bottom:
+    raise RegionError(f"region {tuple(region)} is outside of the screen of size {width}x{height}!")
+  return left, top, right, bottom
+
+def fingerprint(img):
+  # thumbnail averaging FINGERPRINT_BLOCK sized blocks, every pixel contributes so that small changes still move it
+  size = (-(-img.width // FINGERPRINT_BLOCK), -(-img.height // FINGERPRINT_BLOCK))
+  return np.asarray(img.resize(size, Image.Resampling.BOX), dtype = np.int16)
+
+def same_screen(a, b):
+  return a.shape == b.shape and int(np.abs(a - b).max()) <= FINGERPRINT_TOLERANCE
+
+def changed_regions(previous, frame, region = None):
+  # boxes (left, top, right, bottom) around groups of adjacent CHANGE_TILE_SIZE tiles that differ between two frames,
+  # all groups are merged into one box when there are more than MAX_CHANGED_REGIONS of them
+  height, width = frame.shape[:2]
+  left, top, right, bottom = (0, 0, width, height) if region is None else (max(region[0], 0), max(region[1], 0), min(region[2], width), min(region[3], height))
+  if left >= right or top >= bottom: return []
+  # channels are compared as part of the rows, reducing over a short channel axis is several times slower
+  channels = frame.shape[2]
+  diff = (previous[top:bottom, left:right] != frame[top:bottom, left:right]).reshape(bottom - top, (right - left) * channels)
+  rows, cols = -(-(bottom - top) // CHANGE_TILE_SIZE), -(-(right - left) // CHANGE_TILE_SIZE)
+  padded = np.zeros((rows * CHANGE_TILE_SIZE, cols * CHANGE_TILE_SIZE * channels), dtype = bool)
+  padded[:diff.shape[0], :diff.shape[1]] = diff
+  dirty = padded.reshape(rows, CHANGE_TILE_SIZE, cols, CHANGE_TILE_SIZE * channels).any(axis = (1, 3))
+  # flood fill over the dirty tiles, diagonal neighbours belong to the same group
+  unvisited = set((int(row), int(col)) for row, col in np.argwhere(dirty))
+  boxes = list()
+  while unvisited:
+    stack = [unvisited.pop()]
+    row0, col0 = row1, col1 = stack[0]
+    while stack:
+      row, col = stack.pop()
+      row0, row1, col0, col1 = min(row0, row), max(row1, row), min(col0, col), max(col1, col)
+      for neighbour in [(row + i, col + j) for i in (-1, 0, 1) for j in (-1, 0, 1)]:
+        if neighbour in unvisited:
+          unvisited.remove(neighbour)
+          stack.append(neighbour)
+    boxes.append((left + col0 * CHANGE_TILE_SIZE, top + row0 * CHANGE_TILE_SIZE, min(left + (col1 + 1) * CHANGE_TILE_SIZE, right), min(top + (row1 + 1) * CHANGE_TILE_SIZE, bottom)))
+  if len(boxes) > MAX_CHANGED_REGIONS:
+    boxes = [(min(box[0] for box in boxes), min(box[1] for box in boxes), max(box[2] for box in boxes), max(box[3] for box in boxes))]
+  return sorted(boxes, key = lambda box: (box[1], box[0]))
 
 def load_computer_tool(configs):
   class ListActions(BaseModel):
@@ -39,6 +185,7 @@ def load_computer_tool(configs):
     amount: int = Field(description = "scroll amount (positive for up, negative for down)", ge = -10, le = 10)
   class Typing(BaseModel):
     text: str = Field(description = "Text to type")
+    mode: Literal['auto', 'keys', 'paste', 'xdotool'] = Field(default = 'auto', description = "How to enter the text: 'keys' sends one key event per character (ASCII only), 'paste' pastes it through the clipboard, 'xdotool' types it with xdotool. 'auto' uses keys for short ASCII text and otherwise the fastest available mode.")
   class Press(BaseModel):
     key: Literal[*KEYBOARD_KEYS] = Field(description = "Key to press")
   class Wait(BaseModel):
@@ -56,22 +203,58 @@ def load_computer_tool(configs):
     y: int = Field(description = "Y coordinate for mouse actions")
   class HotKey(BaseModel):
     keys: Literal[*HOT_KEYS] = Field(description = "Key combination to press")
+  class WaitUntilStable(BaseModel):
+    region: Optional[List[int]] = Field(None, description = "Optional region to watch, given as [left, top, right, bottom] in screen pixels.", min_length = 4, max_length = 4)
+    stable_for: float = Field(default = 0.5, description = "Seconds the screen has to stay unchanged to count as settled.", gt = 0)
+    timeout: float = Field(default = 10, description = "Maximum number of seconds to wait.", gt = 0)
+  class WaitForChange(BaseModel):
+    region: Optional[List[int]] = Field(None, description = "Optional region to watch, given as [left, top, right, bottom] in screen pixels.", min_length = 4, max_length = 4)
+    timeout: float = Field(default = 10, description = "Maximum number of seconds to wait.", gt = 0)
   class Screenshot(BaseModel):
-    pass
+    region: Optional[List[int]] = Field(None, description = "Optional region of interest to capture, given as [left, top, right, bottom] in screen pixels.", min_length = 4, max_length = 4)
+    max_tokens: Optional[int] = Field(None, description = "Optional budget of vision tokens, the screenshot is downscaled to fit it. Defaults to the configured budget.", gt = 0)
+    changes_only: bool = Field(default = False, description = "Whether to only return the regions that changed since the previous screenshot, or 'no change' if nothing changed.")
+  class SequenceStep(BaseModel):
+    action: Literal['move_to', 'click', 'scroll', 'typing', 'press', 'wait', 'wait_until_stable', 'wait_for_change', 'mouse_down', 'mouse_up', 'drag_to', 'hotkey'] = Field(description = "The compute action to perform")
+    move_to: Optional[MoveTo] = Field(None, description = "parameters for action 'move_to'")
+    click: Optional[Click] = Field(None, description = "parameters for action 'click'")
+    scroll: Optional[Scroll] = Field(None, description = "parameters for action 'scroll'")
+    typing: Optional[Typing] = Field(None, description = "parameters for action 'typing'")
+    press: Optional[Press] = Field(None, description = "parameters for action 'press'")
+    wait: Optional[Wait] = Field(None, description = "parameters for action 'wait'")
+    wait_until_stable: Optional[WaitUntilStable] = Field(None, description = "parameters for action 'wait_until_stable'")
+    wait_for_change: Optional[WaitForChange] = Field(None, description = "parameters for action 'wait_for_change'")
+    mouse_down: Optional[MouseDown] = Field(None, description = "parameters for action 'mouse_down'")
+    mouse_up: Optional[MouseUp] = Field(None, description = "parameters for action 'mouse_up'")
+    drag_to: Optional[DragTo] = Field(None, description = "parameters for action 'drag_to'")
+    hotkey: Optional[HotKey] = Field(None, description = "parameters for action 'hotkey'")
+    @model_validator(mode = "after")
+    @classmethod
+    def require_action_specific_field(cls, self):
+      if getattr(self, self.action) is None:
+        raise ValueError(f"{self.action} must be provided when action is '{self.action}'")
+      return self
+  class Sequence(BaseModel):
+    steps: List[SequenceStep] = Field(description = "actions to perform in order, the remaining steps are skipped after a failed one")
+    delay: Optional[float] = Field(None, description = "Optional delay in seconds between two steps. Defaults to the configured delay.", ge = 0)
+    screenshot: Optional[Screenshot] = Field(None, description = "Optional screenshot to take after the last step")
   class ComputerInput(BaseModel):
-    action: Literal['list_actions', 'move_to', 'click', 'scroll', 'typing', 'press', 'wait', 'mouse_down', 'mouse_up', 'drag_to', 'hotkey', 'screenshot'] = Field(description = "The compute action to perform")
-    list_actions: Optional[ListActions] = Field(None, "list all actions and their function introductions")
-    move_to: Optional[MoveTo] = Field(None, "parameters for action 'move_to'")
-    click: Optional[Click] = Field(None, "parameters for action 'click'")
-    scroll: Optional[Scroll] = Field(None, "parameters for action 'scroll'")
-    typing: Optional[Typing] = Field(None, "parameters for action 'typing'")
-    press: Optional[Press] = Field(None, "parameters for action 'press'")
-    wait: Optional[Wait] = Field(None, "parameters for action 'wait'")
-    mouse_down: Optional[MouseDown] = Field(None, "parameters for action 'mouse_down'")
-    mouse_up: Optional[MouseUp] = Field(None, "parameters for action 'mouse_up'")
-    drag_to: Optional[DragTo] = Field(None, "parameters for action 'drag_to'")
-    hotkey: Optional[HotKey] = Field(None, "parameters for action 'hotkey'")
-    screenshot: Optional[Screenshot] = Field(None, "parameter for action 'screenshot'")
+    action: Literal['list_actions', 'move_to', 'click', 'scroll', 'typing', 'press', 'wait', 'wait_until_stable', 'wait_for_change', 'mouse_down', 'mouse_up', 'drag_to', 'hotkey', 'screenshot', 'sequence'] = Field(description = "The compute action to perform")
+    list_actions: Optional[ListActions] = Field(None, description = "list all actions and their function introductions")
+    move_to: Optional[MoveTo] = Field(None, description = "parameters for action 'move_to'")
+    click: Optional[Click] = Field(None, description = "parameters for action 'click'")
+    scroll: Optional[Scroll] = Field(None, description = "parameters for action 'scroll'")
+    typing: Optional[Typing] = Field(None, description = "parameters for action 'typing'")
+    press: Optional[Press] = Field(None, description = "parameters for action 'press'")
+    wait: Optional[Wait] = Field(None, description = "parameters for action 'wait'")
+    wait_until_stable: Optional[WaitUntilStable] = Field(None, description = "parameters for action 'wait_until_stable'")
+    wait_for_change: Optional[WaitForChange] = Field(None, description = "parameters for action 'wait_for_change'")
+    mouse_down: Optional[MouseDown] = Field(None, description = "parameters for action 'mouse_down'")
+    mouse_up: Optional[MouseUp] = Field(None, description = "parameters for action 'mouse_up'")
+    drag_to: Optional[DragTo] = Field(None, description = "parameters for action 'drag_to'")
+    hotkey: Optional[HotKey] = Field(None, description = "parameters for action 'hotkey'")
+    screenshot: Optional[Screenshot] = Field(None, description = "parameter for action 'screenshot'")
+    sequence: Optional[Sequence] = Field(None, description = "parameters for action 'sequence'")
     @model_validator(mode = "after")
     @classmethod
     def require_action_specific_field(cls, self):
@@ -89,6 +272,10 @@ def load_computer_tool(configs):
         raise ValueError("press must be provided when action is 'press'")
       elif self.action == "wait" and self.wait is None:
         raise ValueError("wait must be provided when action is 'wait'")
+      elif self.action == "wait_until_stable" and self.wait_until_stable is None:
+        raise ValueError("wait_until_stable must be provided when action is 'wait_until_stable'")
+      elif self.action == "wait_for_change" and self.wait_for_change is None:
+        raise ValueError("wait_for_change must be provided when action is 'wait_for_change'")
       elif self.action == "mouse_down" and self.mouse_down is None:
         raise ValueError("mouse_down must be provided when action is 'mouse_down'")
       elif self.action == "mouse_up" and self.mouse_up is None:
@@ -99,32 +286,138 @@ def load_computer_tool(configs):
         raise ValueError("hotkey must be provided when action is 'hotkey'")
       elif self.action == "screenshot" and self.screenshot is None:
         raise ValueError("screenshot must be provided when action is 'screenshot'")
+      elif self.action == "sequence" and self.sequence is None:
+        raise ValueError("sequence must be provided when action is 'sequence'")
       return self
+  class ScreenRegion(BaseModel):
+    left: int = Field(description = "left edge of the region in screen pixels")
+    top: int = Field(description = "top edge of the region in screen pixels")
+    right: int = Field(description = "right edge of the region in screen pixels")
+    bottom: int = Field(description = "bottom edge of the region in screen pixels")
+    mime_type: str = Field(description = "MIME type of the region's picture")
+    base64: str = Field(description = "base64 encoding of the region's picture")
+  class StepResult(BaseModel):
+    action: str = Field(description = "the action of the step")
+    success: Optional[bool] = Field(None, description = "whether the step succeeded, None if it was skipped")
+    result: Optional[str] = Field(None, description = "optional output of the step")
   class ComputerOutput(BaseModel):
     result: Optional[str] = Field(None, description = "optional output")
+    mime_type: Optional[str] = Field(None, description = "MIME type of the screenshot")
+    regions: Optional[List[ScreenRegion]] = Field(None, description = "changed regions of the screen, only for screenshots with changes_only")
+    steps: Optional[List[StepResult]] = Field(None, description = "results of the steps of a sequence in order")
+    elapsed: Optional[float] = Field(None, description = "seconds waited, only for wait_until_stable and wait_for_change")
   class ComputerTool(StructuredTool):
     name: str = "computer_use"
     description: str = "Computer automation tool for controlling the desktop environment."
     args_schema: Type[BaseModel] = ComputerInput
-    def _run(self, action, list_actions = None, move_to = None, click = None, scroll = None, typing = None, press = None, wait = None, mouse_down = None, mouse_up = None, drag_to = None, hotkey = None, screenshot = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+    screenshot_max_tokens: Optional[int] = Field(default = None)
+    screenshot_format: str = Field(default = "JPEG")
+    screenshot_quality: int = Field(default = 80)
+    capture: InstanceOf[ScreenCapture] = Field(default_factory = ScreenCapture)
+    sequence_delay: float = Field(default = 0.1)
+    wait_fps: float = Field(default = 10)
+    typing_interval: float = Field(default = 0.01)
+    typing_keys_max_chars: int = Field(default = 32)
+    paste_hotkey: str = Field(default = "ctrl+v")
+    paste_settle: float = Field(default = 0.2)
+    def _type_text(self, typing):
+      text = typing.text
+      if typing.mode == "keys" or (typing.mode == "auto" and text.isascii() and len(text) <= self.typing_keys_max_chars):
+        pyautogui.typewrite(text, interval = self.typing_interval)
+        return "keys"
+      modes = [typing.mode] if typing.mode != "auto" else ["paste", "xdotool"]
+      errors = list()
+      for mode in modes:
+        try:
+          if mode == "paste":
+            paste_text(text, self.paste_hotkey, self.paste_settle)
+          else:
+            xdotool_type(text)
+          return mode
+        except Exception as e:
+          errors.append(f"{mode}: {e}")
+      # key events are the last resort, they can only enter ASCII text
+      if typing.mode == "auto" and text.isascii():
+        pyautogui.typewrite(text, interval = self.typing_interval)
+        return "keys"
+      raise RuntimeError(f"failed to type the text, {'; '.join(errors)}")
+    def _wait_screen(self, region, timeout, stable_for = None):
+      # samples the screen at wait_fps. without stable_for, returns once it differs from the first sample,
+      # otherwise once consecutive samples stayed the same for stable_for seconds
+      interval = 1 / self.wait_fps
+      if region is not None:
+        # fail before sampling when the region is off the screen
+        clip_region(region, *self.capture.screen_size())
+      start = time.monotonic()
+      reference = fingerprint(self.capture.grab(region)[0])
+      changed_at = start
+      while True:
+        time.sleep(max(0, interval - (time.monotonic() - start) % interval))
+        current = fingerprint(self.capture.grab(region)[0])
+        now = time.monotonic()
+        if not same_screen(current, reference):
+          if stable_for is None:
+            return ComputerOutput(result = f"screen changed after {now - start:.2f}s", elapsed = now - start)
+          reference, changed_at = current, now
+        elif stable_for is not None and now - changed_at >= stable_for:
+          return ComputerOutput(result = f"screen stable after {now - start:.2f}s, last change at {changed_at - start:.2f}s", elapsed = now - start)
+        if now - start >= timeout:
+          return ComputerOutput(result = f"timed out after {now - start:.2f}s, the screen {'kept changing' if stable_for is not None else 'did not change'}", elapsed = now - start)
+    def _run_sequence(self, sequence):
+      # steps run back to back, pyautogui's own pause after every call is replaced by the delay of the sequence
+      delay = self.sequence_delay if sequence.delay is None else sequence.delay
+      results, failed = list(), False
+      pause, pyautogui.PAUSE = pyautogui.PAUSE, 0
+      try:
+        for i, step in enumerate(sequence.steps):
+          if failed:
+            results.append(StepResult(action = step.action, result = "skipped after a failed step"))
+            continue
+          if i > 0 and delay > 0:
+            time.sleep(delay)
+          try:
+            output = self._execute(step.action, **{step.action: getattr(step, step.action)})
+            results.append(StepResult(action = step.action, success = True, result = output.result))
+          except Exception as e:
+            failed = True
+            results.append(StepResult(action = step.action, success = False, result = f"Error: {e}"))
+      finally:
+        pyautogui.PAUSE = pause
+      # the screenshot is taken after a failed step as well, so that the agent sees where the sequence stopped
+      if sequence.screenshot is not None:
+        if delay > 0: time.sleep(delay)
+        output = self._execute("screenshot", screenshot = sequence.screenshot)
+      else:
+        output = ComputerOutput(result = f"{sum(1 for result in results if result.success)} of {len(results)} steps succeeded")
+      output.steps = results
+      return output
+    def _run(self, action, list_actions = None, move_to = None, click = None, scroll = None, typing = None, press = None, wait = None, wait_until_stable = None, wait_for_change = None, mouse_down = None, mouse_up = None, drag_to = None, hotkey = None, screenshot = None, sequence = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+      if action == "sequence":
+        assert sequence is not None, "sequence is None!"
+        return self._run_sequence(sequence)
+      return self._execute(action, list_actions, move_to, click, scroll, typing, press, wait, wait_until_stable, wait_for_change, mouse_down, mouse_up, drag_to, hotkey, screenshot)
+    def _execute(self, action, list_actions = None, move_to = None, click = None, scroll = None, typing = None, press = None, wait = None, wait_until_stable = None, wait_for_change = None, mouse_down = None, mouse_up = None, drag_to = None, hotkey = None, screenshot = None):
       if action == "list_actions":
         result = """list_actions: elaborate the functionalities of all actions.
 move_to: move mouse to given coordinate.
 click: click (or double click) the mouse by a specified button at a specified coordinate.
 scroll: scroll the mouse by a given amount.
-typing: input a specified text through keyboard.
+typing: input a specified text through keyboard, long or non-ASCII text is pasted through the clipboard and the clipboard is restored afterwards.
 press: press a given key on the keyboard.
 wait: wait for a specified period of time in seconds.
+wait_until_stable: wait until the screen, or a region of it, stopped changing, up to a timeout, and return the time waited.
+wait_for_change: wait until the screen, or a region of it, changes, up to a timeout, and return the time waited.
 mouse_down: press a specified button on the mouse at a specified coordinate and hold.
 mouse_up: release a specified button of the mouse at a specified coordinate.
 drag_to: drag mouse from current coordinate to a specified coordinate.
 hotkey: send hot keys from keyboard.
-screenshot: snap a screenshot and return the bytes of the picture in base64 string."""
+screenshot: snap a screenshot, optionally of a region and within a token budget, and return the bytes of the picture in base64 string. with changes_only, only the regions changed since the previous screenshot are returned, or 'no change'.
+sequence: perform a list of the above actions back to back with a delay in between, stop at the first failed one and optionally snap a screenshot at the end."""
         return ComputerOutput(result = result)
       elif action == "move_to":
         assert move_to is not None, "move_to is None!"
         pyautogui.moveTo(move_to.x, move_to.y)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "click":
         assert click is not None, "click is None!"
         if click.num_clicks == 1:
@@ -133,52 +426,77 @@ screenshot: snap a screenshot and return the bytes of the picture in base64 stri
           pyautogui.doubleClick(x = click.x, y = click.y, button = click.button)
         else:
           raise "unknown number of mouse clicks!"
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "scroll":
         assert scroll is not None, "scroll is None!"
         pyautogui.scroll(scroll.amount)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "typing":
         assert typing is not None, "typing is None!"
-        pyautogui.typewrite(typing.text, interval = 0.01)
-        return ComputerTool()
+        mode = self._type_text(typing)
+        return ComputerOutput(result = f"typed {len(typing.text)} characters by {mode}")
       elif action == "press":
         assert press is not None, "press is None!"
         pyautogui.press(press.key)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "wait":
         assert wait is not None, "wait is None!"
         time.sleep(wait.duration)
-        return ComputerTool()
+        return ComputerOutput()
+      elif action == "wait_until_stable":
+        assert wait_until_stable is not None, "wait_until_stable is None!"
+        return self._wait_screen(wait_until_stable.region, wait_until_stable.timeout, wait_until_stable.stable_for)
+      elif action == "wait_for_change":
+        assert wait_for_change is not None, "wait_for_change is None!"
+        return self._wait_screen(wait_for_change.region, wait_for_change.timeout)
       elif action == "mouse_down":
         assert mouse_down is not None, "mouse_down is None!"
         pyautogui.mouseDown(x = mouse_down.x, y = mouse_down.y, button = mouse_down.button)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "mouse_up":
         assert mouse_up is not None, "mouse_up is None!"
         pyautogui.mouseUp(x = mouse_up.x, y = mouse_up.y, button = mouse_up.button)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "drag_to":
         assert drag_to is not None, "drag_to is None!"
         pyautogui.dragTo(x = drag_to.x, y = drag_to.y, duration = 0.3, button = 'left')
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "hotkey":
         assert hotkey is not None, "hotkey is None!"
         keys = hotkey.keys.split('+')
         pyautogui.hotkey(*keys, interval = 0.01)
-        return ComputerTool()
+        return ComputerOutput()
       elif action == "screenshot":
         assert screenshot is not None, "screenshot is None!"
-        img = pyautogui.screenshot()
-        with tempfile.NamedTemporaryFile(suffix = ".png", delete = True) as f:
-          temp_path = f.name
-          f.close()
-        img.save(temp_path, format = 'PNG')
-        with open(temp_path, 'rb') as f:
-          img_bytes = f.read()
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-        return ComputerTool(result = img_base64)
+        img, frame = self.capture.grab()
+        previous, self.capture.previous = self.capture.previous, frame
+        max_tokens = screenshot.max_tokens or self.screenshot_max_tokens
+        encoding = dict(format = self.screenshot_format, quality = self.screenshot_quality, png_compress_level = 1)
+        if screenshot.changes_only and previous is not None and previous.shape == frame.shape:
+          boxes = changed_regions(previous, frame, screenshot.region)
+          if not boxes:
+            return ComputerOutput(result = "no change")
+          left, top, right, bottom = screenshot.region or (0, 0, img.width, img.height)
+          if sum((box[2] - box[0]) * (box[3] - box[1]) for box in boxes) <= MAX_CHANGED_AREA * (right - left) * (bottom - top):
+            # regions are scaled like the full screenshot would be, so that they can be pasted onto it
+            ratio = target_ratio(right - left, bottom - top, DEFAULT_MAX_WIDTH, DEFAULT_MAX_HEIGHT, max_tokens = max_tokens)
+            regions = list()
+            for box in boxes:
+              prepared = prepare_image(img, max_width = max(int((box[2] - box[0]) * ratio), 1), max_height = max(int((box[3] - box[1]) * ratio), 1), region = box, **encoding)
+              regions.append(ScreenRegion(left = box[0], top = box[1], right = box[2], bottom = box[3], mime_type = prepared.mime_type, base64 = prepared.to_base64()))
+            return ComputerOutput(result = f"{len(regions)} regions changed", regions = regions)
+        prepared = prepare_image(img, max_tokens = max_tokens, region = screenshot.region, **encoding)
+        return ComputerOutput(result = prepared.to_base64(), mime_type = prepared.mime_type)
       else:
         raise Exception('unknown action!')
-  return ComputerTool()
+  return ComputerTool(
+    screenshot_max_tokens = configs.computer_screenshot_max_tokens,
+    screenshot_format = configs.computer_screenshot_format,
+    screenshot_quality = configs.computer_screenshot_quality,
+    sequence_delay = configs.computer_sequence_delay,
+    wait_fps = configs.computer_wait_fps,
+    typing_interval = configs.computer_typing_interval,
+    typing_keys_max_chars = configs.computer_typing_keys_max_chars,
+    paste_hotkey = configs.computer_paste_hotkey,
+    paste_settle = configs.computer_paste_settle)
 
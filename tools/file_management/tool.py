@@ -1,11 +1,273 @@
 #!/usr/bin/python3
 
-from typing import List, Literal, Optional, Dict, Type
+import os
+import re
+import asyncio
+import time
+import mmap
+import atexit
+import fnmatch
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache, partial
+from os.path import join, relpath, normpath
+from pathlib import Path
+from typing import Any, List, Literal, Optional, Dict, Type
 from pydantic import BaseModel, Field, ValidationError, model_validator
 from langchain_core.tools import BaseTool
 from langchain_core.tools.structured import StructuredTool
 from langchain_community.agent_toolkits import FileManagementToolkit
-from langchain_core.callbacks.manager import CallbackManagerForToolRun
+from langchain_core.callbacks.manager import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
+from langchain_community.tools.file_management.utils import INVALID_PATH_TEMPLATE, FileValidationError, get_validated_relative_path
+
+LINE_INDEX_STRIDE = 1024
+SUMMARY_HEAD_LINES = 20
+GREP_MMAP_BYTES = 1024**2
+GREP_MAX_LINE_CHARS = 500
+GREP_PROCESS_MIN_FILES = 256
+
+def find_nth_newline(buf, start, n, end):
+  # position right after the n-th newline at or after start, None if there are fewer newlines before end.
+  # counting runs over doubling windows and then halves the window, so the python loop is logarithmic in the distance
+  if n <= 0: return start
+  window, lo = 4096, start
+  while True:
+    hi = min(lo + window, end)
+    count = buf[lo:hi].count(b'\n')
+    if count >= n: break
+    if hi >= end: return None
+    n, lo, window = n - count, hi, window * 2
+  while hi - lo > 4096:
+    mid = (lo + hi) // 2
+    count = buf[lo:mid].count(b'\n')
+    if count >= n: hi = mid
+    else: n, lo = n - count, mid
+  for _ in range(n):
+    lo = buf.find(b'\n', lo, hi) + 1
+  return lo
+
+@lru_cache(maxsize = 32)
+def line_index(path, mtime_ns, size):
+  # byte offsets of the start of every LINE_INDEX_STRIDE-th line and the number of lines,
+  # mtime and size are part of the cache key so that a changed file gets a new index
+  checkpoints, pos = array('q', [0]), 0
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+    while True:
+      pos = find_nth_newline(buf, pos, LINE_INDEX_STRIDE, size)
+      if pos is None or pos >= size: break
+      checkpoints.append(pos)
+    newlines = sum(buf[i:i + 2**20].count(b'\n') for i in range(0, size, 2**20))
+    last_line = 0 if buf[size - 1:size] == b'\n' else 1
+  return checkpoints, newlines + last_line
+
+def gitignore_regex(pattern):
+  # translate a gitignore glob to a regex matched against slash separated relative paths
+  regex, i = "", 0
+  while i < len(pattern):
+    if pattern.startswith('**/', i):
+      regex, i = regex + '(?:.*/)?', i + 3
+    elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+      regex, i = regex + '/.*', i + 3
+    elif pattern[i] == '*':
+      regex, i = regex + '[^/]*', i + 1
+    elif pattern[i] == '?':
+      regex, i = regex + '[^/]', i + 1
+    elif pattern[i] == '[' and pattern.find(']', i + 2) > 0:
+      end = pattern.find(']', i + 2)
+      body = pattern[i + 1:end]
+      body = '^' + body[1:] if body[0] == '!' else body
+      regex, i = regex + '[' + body.replace('\\', '\\\\') + ']', end + 1
+    elif pattern[i] == '\\' and i + 1 < len(pattern):
+      regex, i = regex + re.escape(pattern[i + 1]), i + 2
+    else:
+      regex, i = regex + re.escape(pattern[i]), i + 1
+  return re.compile(regex)
+
+@lru_cache(maxsize = 256)
+def gitignore_rules(path, mtime_ns, base):
+  # rules of a .gitignore file as (base directory, regex, negated, directory only, anchored), a subset of the git semantics:
+  # comments, negation, anchoring, trailing slashes and ** wildcards
+  rules = list()
+  try:
+    with open(path, 'r', encoding = 'utf-8', errors = 'replace') as f:
+      lines = f.read().splitlines()
+  except OSError:
+    return rules
+  for line in lines:
+    line = line.rstrip()
+    if not line or line.startswith('#'): continue
+    negate = line.startswith('!')
+    line = line[1:] if negate else line
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line: continue
+    # a pattern with a slash is relative to the directory of the .gitignore, otherwise it matches the name at any depth
+    anchored = '/' in line
+    rules.append((base, gitignore_regex(line.lstrip('/')), negate, dir_only, anchored))
+  return rules
+
+def gitignored(rules, rel_dir, name, is_dir):
+  ignored = False
+  for base, regex, negate, dir_only, anchored in rules:
+    if dir_only and not is_dir: continue
+    if anchored:
+      path = name if rel_dir == base else join(rel_dir if base == '.' else rel_dir[len(base) + 1:], name)
+      if regex.fullmatch(path.replace(os.sep, '/')): ignored = not negate
+    elif regex.fullmatch(name): ignored = not negate
+  return ignored
+
+def grep_file(path, pattern, ignore_case = False, context = 0, max_hits = None):
+  # matching lines of a file as (line number, number of the first context line, lines), binary files are skipped.
+  # large files are mapped instead of read and the regex runs over bytes, so no decoding is paid for non matching files.
+  # raw file descriptors are used since a file object costs more than reading a small file
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except OSError:
+    return []
+  try:
+    size = os.fstat(fd).st_size
+    buf = mmap.mmap(fd, 0, access = mmap.ACCESS_READ) if size > GREP_MMAP_BYTES else os.read(fd, size)
+  except (OSError, ValueError):
+    return []
+  finally:
+    os.close(fd)
+  size = len(buf)
+  if size == 0 or buf.find(b'\0', 0, 8192) >= 0:
+    if isinstance(buf, mmap.mmap): buf.close()
+    return []
+  try:
+    # grep semantics: ^ and $ anchor at every line and a hit never spans lines
+    regex = re.compile(pattern.encode('utf-8'), re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    hits, line_no, counted, pos = list(), 1, 0, 0
+    while pos < size:
+      match = regex.search(buf, pos)
+      # the empty position after a final newline is not a line
+      if match is None or (match.start() == size and buf[size - 1:size] == b'\n'): break
+      start = match.start()
+      line_start = buf.rfind(b'\n', 0, start) + 1
+      line_end = buf.find(b'\n', start)
+      line_end = size if line_end < 0 else line_end
+      if match.end() > line_end and regex.search(buf, line_start, line_end) is None:
+        # the match only exists across a newline, the line itself does not match
+        pos = line_end + 1
+        continue
+      pos = line_end + 1
+      line_no += buf[counted:line_start].count(b'\n')
+      counted = line_start
+      first, first_no = line_start, line_no
+      for _ in range(context):
+        if first == 0: break
+        first, first_no = buf.rfind(b'\n', 0, first - 1) + 1, first_no - 1
+      last = line_end
+      for _ in range(context):
+        if last >= size - 1: break
+        last = buf.find(b'\n', last + 1)
+        last = size if last < 0 else last
+      lines = buf[first:last].decode('utf-8', errors = 'replace').split('\n')
+      hits.append((line_no, first_no, [line[:GREP_MAX_LINE_CHARS] for line in lines]))
+      if max_hits is not None and len(hits) >= max_hits: break
+    return hits
+  finally:
+    if isinstance(buf, mmap.mmap): buf.close()
+
+class FileOperationError(Exception):
+  # a failed operation, its message is the error text returned to the caller
+  pass
+
+class WorkspaceIndex(object):
+  # in-memory tree of the workspace, a directory is only rescanned when its mtime changed
+  def __init__(self, root_dir, ttl = 1.0):
+    self.root_dir = str(Path(root_dir).resolve())
+    self.ttl = ttl
+    self.entries = dict() # relative directory -> (mtime_ns, sorted file names, sorted (subdirectory name, is symlink))
+    self.validated = dict() # relative directory -> time its subtree was last revalidated
+    self.lock = threading.Lock()
+  def _scan(self, rel_dir, mtime):
+    files, dirs = list(), list()
+    with os.scandir(join(self.root_dir, rel_dir)) as it:
+      for entry in it:
+        try:
+          is_dir = entry.is_dir()
+        except OSError:
+          is_dir = False
+        if is_dir: dirs.append((entry.name, entry.is_symlink()))
+        else: files.append(entry.name)
+    # a directory changed within the timestamp granularity may change again unnoticed, rescan it next time
+    if time.time_ns() - mtime < 1e9: mtime = None
+    self.entries[rel_dir] = (mtime, sorted(files), sorted(dirs))
+  def _drop(self, rel_dir):
+    prefix = rel_dir + os.sep
+    for key in [key for key in self.entries if key == rel_dir or key.startswith(prefix) or rel_dir == '.']:
+      self.entries.pop(key)
+  def _refresh(self, rel_dir):
+    # revalidate a subtree, an unchanged directory costs a single stat and a missing index amounts to a full walk
+    stack = [rel_dir]
+    while stack:
+      current = stack.pop()
+      try:
+        mtime = os.stat(join(self.root_dir, current)).st_mtime_ns
+      except OSError:
+        self._drop(current)
+        continue
+      cached = self.entries.get(current)
+      if cached is None or cached[0] != mtime:
+        self._scan(current, mtime)
+        if cached is not None:
+          for name in set(name for name, _ in cached[2]) - set(name for name, _ in self.entries[current][2]):
+            self._drop(normpath(join(current, name)))
+      # symlinked directories are listed but not descended into, like os.walk
+      stack.extend(normpath(join(current, name)) for name, is_link in self.entries[current][2] if not is_link)
+  def _ensure(self, rel_dir):
+    if time.time() - self.validated.get(rel_dir, 0) > self.ttl:
+      self._refresh(rel_dir)
+      self.validated[rel_dir] = time.time()
+  def invalidate(self):
+    # called after files were changed through the tool so that the next query revalidates
+    with self.lock:
+      self.validated.clear()
+  def _gitignore(self, rel_dir):
+    path = join(self.root_dir, rel_dir, '.gitignore')
+    try:
+      mtime = os.stat(path).st_mtime_ns
+    except OSError:
+      return []
+    return gitignore_rules(path, mtime, rel_dir)
+  def search(self, rel_dir, pattern, gitignore = False):
+    # file paths relative to rel_dir whose names match pattern, optionally without .git and the paths ignored by .gitignore files
+    with self.lock:
+      self._ensure(rel_dir)
+      rules = list()
+      if gitignore:
+        parts = [] if rel_dir == '.' else rel_dir.split(os.sep)
+        # rules of the parent directories apply as well, a directory given explicitly is searched even if it is ignored
+        for depth in range(len(parts)):
+          rules = rules + self._gitignore(os.sep.join(parts[:depth]) or '.')
+      matches, stack = list(), [(rel_dir, rules)]
+      while stack:
+        current, rules = stack.pop()
+        cached = self.entries.get(current)
+        if cached is None: continue
+        if gitignore and '.gitignore' in cached[1]: rules = rules + self._gitignore(current)
+        # directory keys are normalized, so paths relative to rel_dir are plain prefix strips
+        prefix = "" if current == rel_dir else (current if rel_dir == '.' else current[len(rel_dir) + 1:]) + os.sep
+        names = fnmatch.filter(cached[1], pattern)
+        if rules: names = [name for name in names if not gitignored(rules, current, name, False)]
+        matches.extend(prefix + name for name in names)
+        for name, is_link in reversed(cached[2]):
+          if is_link or (gitignore and name == '.git'): continue
+          if rules and gitignored(rules, current, name, True): continue
+          stack.append((normpath(join(current, name)), rules))
+      return matches
+  def list_directory(self, rel_dir):
+    with self.lock:
+      self._ensure(rel_dir)
+      cached = self.entries.get(rel_dir)
+      if cached is None: return None
+      return sorted(cached[1] + [name for name, _ in cached[2]])
+  def relative_path(self, dir_path):
+    return relpath(get_validated_relative_path(Path(self.root_dir), dir_path), self.root_dir)
 
 def load_file_management_tool(configs):
   class ListActions(BaseModel):
@@ -18,27 +280,67 @@ def load_file_management_tool(configs):
   class FileSearch(BaseModel):
     dir_path: str = Field(default = ".", description = "Subdirectory to search in.")
     pattern: str = Field(..., description = "Unix shell regex, where * matches everything.")
+    offset: int = Field(default = 0, description = "Number of matches to skip, used to get the next page of results.")
+    limit: int = Field(default = 200, description = "Maximum number of matches to return.")
+  class GrepContent(BaseModel):
+    pattern: str = Field(..., description = "Python regular expression to search for in the contents of files.")
+    dir_path: str = Field(default = ".", description = "Subdirectory to search in.")
+    file_pattern: str = Field(default = "*", description = "Unix shell regex the file names must match, for example *.py.")
+    ignore_case: bool = Field(default = False, description = "Whether to match case insensitively.")
+    context: int = Field(default = 0, description = "Number of lines to show before and after each matching line.", ge = 0, le = 10)
+    offset: int = Field(default = 0, description = "Number of matching lines to skip, used to get the next page of results.", ge = 0)
+    limit: int = Field(default = 100, description = "Maximum number of matching lines to return.", ge = 1)
   class ListDirectory(BaseModel):
     dir_path: str = Field(default = ".", description = "Subdirectory to list.")
+    offset: int = Field(default = 0, description = "Number of entries to skip, used to get the next page of entries.")
+    limit: int = Field(default = 200, description = "Maximum number of entries to return.")
   class MoveFile(BaseModel):
     source_path: str = Field(..., description = "Path of the file to move")
     destination_path: str = Field(..., description = "New path for the moved file")
   class ReadFile(BaseModel):
     file_path: str = Field(..., description = "name of file")
+    offset: Optional[int] = Field(None, description = "Optional byte offset to start reading from.", ge = 0)
+    length: Optional[int] = Field(None, description = "Optional number of bytes to read.", ge = 0)
+    start_line: Optional[int] = Field(None, description = "Optional line number (starting from 1) to start reading from.", ge = 1)
+    num_lines: Optional[int] = Field(None, description = "Optional number of lines to read.", ge = 0)
+    tail: Optional[int] = Field(None, description = "Optional number of lines at the end of the file to read.", ge = 0)
+    summary: bool = Field(default = False, description = "Whether to only return the size, the number of lines and the first lines of the file.")
   class WriteFile(BaseModel):
     file_path: str = Field(..., description = "name of file")
     text: str = Field(..., description="text to write to file")
     append: bool = Field(default=False, description="Whether to append to an existing file.")
+  class BatchOperation(BaseModel):
+    action: Literal["copy_file", "file_delete", "file_search", "grep_content", "list_directory", "move_file", "read_file", "write_file"] = Field(..., description = "a file management action")
+    copy_file: Optional[CopyFile] = Field(None, description = "parameters for action 'copy_file'")
+    file_delete: Optional[FileDelete] = Field(None, description = "parameters for action 'file_delete'")
+    file_search: Optional[FileSearch] = Field(None, description = "parameters for action 'file_search'")
+    grep_content: Optional[GrepContent] = Field(None, description = "parameters for action 'grep_content'")
+    list_directory: Optional[ListDirectory] = Field(None, description = "parameters for action 'list_directory'")
+    move_file: Optional[MoveFile] = Field(None, description = "parameters for action 'move_file'")
+    read_file: Optional[ReadFile] = Field(None, description = "parameters for action 'read_file'")
+    write_file: Optional[WriteFile] = Field(None, description = "parameters for action 'write_file'")
+    @model_validator(mode = "after")
+    @classmethod
+    def require_action_specific_field(cls, self):
+      if getattr(self, self.action) is None:
+        raise ValueError(f"{self.action} must be provided when action is '{self.action}'")
+      return self
+  class Batch(BaseModel):
+    operations: List[BatchOperation] = Field(..., description = "file management operations to perform in order")
+    stop_on_error: bool = Field(default = True, description = "Whether to skip the remaining operations after the first failed one, otherwise all operations are attempted.")
+    parallel: bool = Field(default = False, description = "Whether to run operations on unrelated paths concurrently. Operations on the same path always run in order.")
   class FileManagementInput(BaseModel):
-    action: Literal["list_actions", "copy_file", "file_delete", "file_search", "list_directory", "move_file", "read_file", "write_file"] = Field(..., description = "a file management action")
+    action: Literal["list_actions", "copy_file", "file_delete", "file_search", "grep_content", "list_directory", "move_file", "read_file", "write_file", "batch"] = Field(..., description = "a file management action")
     list_actions: Optional[ListActions] = Field(None, description = "list all actions and their function introductions")
     copy_file: Optional[CopyFile] = Field(None, description = "parameters for action 'copy_file'")
     file_delete: Optional[FileDelete] = Field(None, description = "parameters for action 'file_delete'")
     file_search: Optional[FileSearch] = Field(None, description = "parameters for action 'file_search'")
+    grep_content: Optional[GrepContent] = Field(None, description = "parameters for action 'grep_content'")
     list_directory: Optional[ListDirectory] = Field(None, description = "parameters for action 'list_directory'")
     move_file: Optional[MoveFile] = Field(None, description = "parameters for action 'move_file'")
     read_file: Optional[ReadFile] = Field(None, description = "parameters for action 'read_file'")
     write_file: Optional[WriteFile] = Field(None, description = "parameters for action 'write_file'")
+    batch: Optional[Batch] = Field(None, description = "parameters for action 'batch'")
     @model_validator(mode = "after")
     @classmethod
     def require_action_specific_field(cls, self):
@@ -50,6 +352,8 @@ def load_file_management_tool(configs):
         raise ValueError("file_delete must be provided when action is 'file_delete'")
       elif self.action == "file_search" and self.file_search is None:
         raise ValueError("file_search must be provided when action is 'file_search'")
+      elif self.action == "grep_content" and self.grep_content is None:
+        raise ValueError("grep_content must be provided when action is 'grep_content'")
       elif self.action == "list_directory" and self.list_directory is None:
         raise ValueError("list_directory must be provided when action is 'list_directory'")
       elif self.action == "move_file" and self.move_file is None:
@@ -58,53 +362,249 @@ def load_file_management_tool(configs):
         raise ValueError("read_file must be provided when action is 'read_file'")
       elif self.action == "write_file" and self.write_file is None:
         raise ValueError("write_file must be provided when action is 'write_file'")
+      elif self.action == "batch" and self.batch is None:
+        raise ValueError("batch must be provided when action is 'batch'")
       return self
+  class BatchResult(BaseModel):
+    action: str = Field(description = "the action of the operation")
+    success: Optional[bool] = Field(None, description = "whether the operation succeeded, None if it was skipped")
+    result: str = Field(description = "result of the operation")
   class FileManagementOutput(BaseModel):
     result: str = Field(description = "file management process result")
+    results: Optional[List[BatchResult]] = Field(None, description = "results of the operations of a batch in order")
   class FileManagementConfig(BaseModel):
     class Config:
       arbitrary_types_allowed = True
     tools: Dict[str, BaseModel]
+    index: WorkspaceIndex
+    executor: ThreadPoolExecutor
+    grep_executor: Optional[Any] = None
+    grep_lock: Any = Field(default_factory = threading.Lock)
   class FileManagementTool(StructuredTool):
     name: str = "file_management"
-    description: str = "This toolkit provides methods to interact with local files. available actions are copy_file, file_delete, file_search, list_directory, move_file, read_file and write_file."
+    description: str = "This toolkit provides methods to interact with local files. available actions are copy_file, file_delete, file_search, grep_content, list_directory, move_file, read_file, write_file and batch."
     args_schema: Type[BaseModel] = FileManagementInput
     config: FileManagementConfig
-    def _run(self, action, list_actions = None, copy_file = None, file_delete = None, file_search = None, list_directory = None, move_file = None, read_file = None, write_file = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+    max_read_bytes: int = Field(default = 1024**2)
+    max_workers: int = Field(default = 8)
+    grep_processes: int = Field(default = 4)
+    def _invoke_tool(self, name, args):
+      # the toolkit tools which change files return a status message, failures are the ones starting with Error
+      result = self.config.tools[name].invoke(args)
+      if result.startswith("Error"):
+        raise FileOperationError(result)
+      return result
+    def _read_file(self, read_file):
+      # ranged reads map the file instead of loading it, whole reads of large files fall back to a summary
+      try:
+        path = get_validated_relative_path(Path(self.config.index.root_dir), read_file.file_path)
+      except FileValidationError:
+        raise FileOperationError(INVALID_PATH_TEMPLATE.format(arg_name = "file_path", value = read_file.file_path))
+      if not path.is_file():
+        raise FileOperationError(f"Error: no such file or directory: {read_file.file_path}")
+      stat = path.stat()
+      ranged = any(value is not None for value in (read_file.offset, read_file.length, read_file.start_line, read_file.num_lines, read_file.tail))
+      if not ranged and not read_file.summary and stat.st_size <= self.max_read_bytes:
+        # read here rather than by the toolkit tool, whose errors cannot be told apart from file content
+        try:
+          with open(path, 'r', encoding = 'utf-8') as f:
+            return f.read()
+        except (OSError, UnicodeDecodeError) as e:
+          raise FileOperationError(f"Error: {e}")
+      if stat.st_size == 0:
+        return "size: 0 bytes, lines: 0." if read_file.summary else ""
+      with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+        if read_file.tail is not None:
+          # like the other ranged reads at most max_read_bytes are returned, however many lines are asked for
+          floor = max(stat.st_size - self.max_read_bytes, 0)
+          end = stat.st_size - 1 if buf[-1:] == b'\n' else stat.st_size
+          start = end
+          for _ in range(read_file.tail):
+            start = buf.rfind(b'\n', floor, start)
+            if start < 0: break
+          content = buf[start + 1 if start >= 0 else floor:stat.st_size]
+        elif read_file.start_line is not None or read_file.num_lines is not None:
+          checkpoints, _ = line_index(str(path), stat.st_mtime_ns, stat.st_size)
+          line = (read_file.start_line or 1) - 1
+          if line // LINE_INDEX_STRIDE >= len(checkpoints): return ""
+          start = find_nth_newline(buf, checkpoints[line // LINE_INDEX_STRIDE], line % LINE_INDEX_STRIDE, stat.st_size)
+          if start is None: return ""
+          end = stat.st_size if read_file.num_lines is None else find_nth_newline(buf, start, read_file.num_lines, stat.st_size)
+          end = stat.st_size if end is None else end
+          content = buf[start:min(end, start + self.max_read_bytes)]
+        elif read_file.offset is not None or read_file.length is not None:
+          start = read_file.offset or 0
+          length = self.max_read_bytes if read_file.length is None else min(read_file.length, self.max_read_bytes)
+          content = buf[start:start + length]
+        else:
+          _, total_lines = line_index(str(path), stat.st_mtime_ns, stat.st_size)
+          end = find_nth_newline(buf, 0, SUMMARY_HEAD_LINES, stat.st_size) or stat.st_size
+          head = buf[0:min(end, 4096)].decode('utf-8', errors = 'replace')
+          hint = "" if read_file.summary else " The file is too large to read at once, read it by lines or bytes."
+          return f"size: {stat.st_size} bytes, lines: {total_lines}.{hint}\nfirst lines:\n{head}"
+      return content.decode('utf-8', errors = 'replace')
+    def _grep_content(self, grep_content):
+      # files come from the index, large trees are scanned by a pool of processes since the regex holds the GIL.
+      # results keep the file order and scanning stops once the requested page is filled
+      index = self.config.index
+      try:
+        rel_dir = index.relative_path(grep_content.dir_path)
+      except FileValidationError:
+        raise FileOperationError(INVALID_PATH_TEMPLATE.format(arg_name = "dir_path", value = grep_content.dir_path))
+      try:
+        re.compile(grep_content.pattern.encode('utf-8'))
+      except re.error as e:
+        raise FileOperationError(f"Error: invalid regular expression {grep_content.pattern}: {e}")
+      files = index.search(rel_dir, grep_content.file_pattern, gitignore = True)
+      wanted = grep_content.offset + grep_content.limit
+      scan = partial(grep_file, pattern = grep_content.pattern, ignore_case = grep_content.ignore_case, context = grep_content.context, max_hits = wanted + 1)
+      paths = [join(index.root_dir, rel_dir, name) for name in files]
+      if len(paths) >= GREP_PROCESS_MIN_FILES and min(self.grep_processes, os.cpu_count() or 1) > 1:
+        with self.config.grep_lock:
+          if self.config.grep_executor is None:
+            # not forked from here, a fork of a worker thread while other threads hold locks can deadlock in the child
+            self.config.grep_executor = ProcessPoolExecutor(max_workers = min(self.grep_processes, os.cpu_count() or 1), mp_context = multiprocessing.get_context('forkserver'))
+            atexit.register(self.config.grep_executor.shutdown)
+        results = self.config.grep_executor.map(scan, paths, chunksize = 64)
+      else:
+        results = map(scan, paths)
+      hits = list()
+      for name, file_hits in zip(files, results):
+        hits.extend((name, hit) for hit in file_hits)
+        if len(hits) > wanted: break
+      if hasattr(results, 'close'): results.close()
+      if not hits:
+        return f"No matches found for pattern {grep_content.pattern} in directory {grep_content.dir_path}"
+      # hits of a file whose context windows overlap or touch are merged into one group, so no line is printed twice
+      groups = list()
+      for name, (line_no, first_no, context_lines) in hits[grep_content.offset:wanted]:
+        if not groups or groups[-1][0] != name or first_no > max(groups[-1][1]) + 1:
+          groups.append((name, dict(), set()))
+        groups[-1][1].update(enumerate(context_lines, first_no))
+        groups[-1][2].add(line_no)
+      lines = list()
+      for name, group_lines, matched in groups:
+        if grep_content.context and lines: lines.append("--")
+        # grep style, matching lines are name:number:text and context lines name-number-text
+        lines.extend(f"{name}{':' if no in matched else '-'}{no}{':' if no in matched else '-'}{line}" for no, line in sorted(group_lines.items()))
+      result = "\n".join(lines)
+      if len(hits) > wanted:
+        result += f"\n... more matches, use offset {wanted} to get the next page"
+      return result
+    def _paginate(self, items, offset, limit):
+      page = items[offset:offset + limit]
+      result = "\n".join(page)
+      if offset + limit < len(items):
+        result += f"\n... {len(items) - offset - limit} more, use offset {offset + limit} to get the next page"
+      return result
+    def _paths(self, operation):
+      params = getattr(operation, operation.action)
+      paths = [getattr(params, field) for field in ('source_path', 'destination_path', 'file_path', 'dir_path') if hasattr(params, field)]
+      return [normpath(path) for path in paths]
+    def _waves(self, operations):
+      # an operation runs after every earlier operation on the same path, a parent or a child of it
+      def related(a, b):
+        return a == b or a == '.' or b == '.' or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+      paths, waves = [self._paths(operation) for operation in operations], list()
+      for i in range(len(operations)):
+        wave = max([waves[j] + 1 for j in range(i) if any(related(a, b) for a in paths[i] for b in paths[j])], default = 0)
+        waves.append(wave)
+      return [[i for i in range(len(operations)) if waves[i] == wave] for wave in range(max(waves, default = -1) + 1)]
+    def _run_operation(self, operation):
+      try:
+        result = self._execute(operation.action, **{operation.action: getattr(operation, operation.action)})
+        return BatchResult(action = operation.action, success = True, result = result)
+      except FileOperationError as e:
+        return BatchResult(action = operation.action, success = False, result = str(e))
+      except Exception as e:
+        return BatchResult(action = operation.action, success = False, result = f"Error: {e}")
+    def _run_batch(self, batch):
+      results = [None] * len(batch.operations)
+      failed = False
+      with ThreadPoolExecutor(max_workers = self.max_workers if batch.parallel else 1) as executor:
+        for wave in (self._waves(batch.operations) if batch.parallel else [[i] for i in range(len(batch.operations))]):
+          if failed and batch.stop_on_error: break
+          for i, result in zip(wave, executor.map(lambda i: self._run_operation(batch.operations[i]), wave)):
+            results[i] = result
+            failed = failed or not result.success
+      results = [result if result is not None else BatchResult(action = operation.action, result = "skipped after a failed operation") for operation, result in zip(batch.operations, results)]
+      succeeded = sum(1 for result in results if result.success)
+      return FileManagementOutput(result = f"{succeeded} of {len(results)} operations succeeded", results = results)
+    def _run(self, action, list_actions = None, copy_file = None, file_delete = None, file_search = None, grep_content = None, list_directory = None, move_file = None, read_file = None, write_file = None, batch = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+      if action == "batch":
+        assert batch is not None, "batch is None!"
+        return self._run_batch(batch)
+      try:
+        return FileManagementOutput(result = self._execute(action, list_actions, copy_file, file_delete, file_search, grep_content, list_directory, move_file, read_file, write_file))
+      except FileOperationError as e:
+        return FileManagementOutput(result = str(e))
+    def _execute(self, action, list_actions = None, copy_file = None, file_delete = None, file_search = None, grep_content = None, list_directory = None, move_file = None, read_file = None, write_file = None):
       if action == "list_actions":
         assert list_actions is not None, "list_actions is None!"
         result = """list_actions: elaborate the functionalities of all actions.
 copy_file: copy a file from a given source path to another given destination path.
 file_delete: delete a file at a given path.
-file_search: search files under a given directory with a given file name regex pattern.
-list_directory: list files under a given directory.
+file_search: search files under a given directory with a given file name regex pattern, results are paginated by offset and limit.
+grep_content: search the contents of files under a given directory with a given regular expression, skipping binary and git ignored files, and return the matching lines with line numbers and optional context, paginated by offset and limit.
+list_directory: list files under a given directory, entries are paginated by offset and limit.
 move_file: move file from a given source path to another given destination path.
-read_file: read the content of a file at the given file path.
-write_file: write a given text to a file at the given path."""
+read_file: read the content of a file at the given file path, optionally a range of bytes or lines, the last lines or a summary.
+write_file: write a given text to a file at the given path.
+batch: perform a list of the above operations in one call, optionally concurrently, and return the result of each."""
       elif action == "copy_file":
         assert copy_file is not None, "copy_file is None!"
-        result = self.config.tools['copy_file'].invoke({'source_path': copy_file.source_path, 'destination_path': copy_file.destination_path})
+        result = self._invoke_tool('copy_file', {'source_path': copy_file.source_path, 'destination_path': copy_file.destination_path})
+        self.config.index.invalidate()
       elif action == "file_delete":
         assert file_delete is not None, "file_delete is None!"
-        result = self.config.tools['file_delete'].invoke({'file_path': file_delete.file_path})
+        result = self._invoke_tool('file_delete', {'file_path': file_delete.file_path})
+        self.config.index.invalidate()
       elif action == "file_search":
         assert file_search is not None, "file_search is None!"
-        result = self.config.tools['file_search'].invoke({'pattern': file_search.pattern, 'dir_path': file_search.dir_path})
+        try:
+          matches = self.config.index.search(self.config.index.relative_path(file_search.dir_path), file_search.pattern)
+          if matches:
+            result = self._paginate(matches, file_search.offset, file_search.limit)
+          else:
+            result = f"No files found for pattern {file_search.pattern} in directory {file_search.dir_path}"
+        except FileValidationError:
+          raise FileOperationError(INVALID_PATH_TEMPLATE.format(arg_name = "dir_path", value = file_search.dir_path))
+      elif action == "grep_content":
+        assert grep_content is not None, "grep_content is None!"
+        result = self._grep_content(grep_content)
       elif action == "list_directory":
         assert list_directory is not None, "list_directory is None!"
-        result = self.config.tools['list_directory'].invoke({'dir_path': list_directory.dir_path})
+        try:
+          entries = self.config.index.list_directory(self.config.index.relative_path(list_directory.dir_path))
+          if entries is None:
+            raise FileOperationError(f"Error: no such directory: {list_directory.dir_path}")
+          elif entries:
+            result = self._paginate(entries, list_directory.offset, list_directory.limit)
+          else:
+            result = f"No files found in directory {list_directory.dir_path}"
+        except FileValidationError:
+          raise FileOperationError(INVALID_PATH_TEMPLATE.format(arg_name = "dir_path", value = list_directory.dir_path))
       elif action == "move_file":
         assert move_file is not None, "move_file is None!"
-        result = self.config.tools['move_file'].invoke({'source_path': move_file.source_path, 'destination_path': move_file.destination_path})
+        result = self._invoke_tool('move_file', {'source_path': move_file.source_path, 'destination_path': move_file.destination_path})
+        self.config.index.invalidate()
       elif action == "read_file":
         assert read_file is not None, "read_file is None!"
-        result = self.config.tools['read_file'].invoke({'file_path': read_file.file_path})
+        result = self._read_file(read_file)
       elif action == "write_file":
         assert write_file is not None, "write_file is None!"
-        result = self.config.tools['write_file'].invoke({'file_path': write_file.file_path, 'text': write_file.text, 'append': write_file.append})
+        result = self._invoke_tool('write_file', {'file_path': write_file.file_path, 'text': write_file.text, 'append': write_file.append})
+        self.config.index.invalidate()
       else:
         raise Exception('unknown action!')
-      return FileManagementOutput(result = result)
-    async def _arun(self, action, copy_file = None, file_delete = None, file_search = None, list_directory = None, move_file = None, read_file = None, write_file = None, run_manager: Optional[CallbackManagerForToolRun] = None):
-      raise NotImplementedError("Async execution is not supported!")
-  return FileManagementTool(config = FileManagementConfig(tools = {t.name: t for t in FileManagementToolkit(root_dir = configs.workspace_dir).get_tools()}))
+      return result
+    async def _arun(self, action, list_actions = None, copy_file = None, file_delete = None, file_search = None, grep_content = None, list_directory = None, move_file = None, read_file = None, write_file = None, batch = None, run_manager: Optional[AsyncCallbackManagerForToolRun] = None):
+      # disk I/O runs on a bounded executor, so the event loop is never blocked and at most file_async_workers operations run at once
+      return await asyncio.get_running_loop().run_in_executor(self.config.executor, partial(self._run, action, list_actions, copy_file, file_delete, file_search, grep_content, list_directory, move_file, read_file, write_file, batch))
+  return FileManagementTool(config = FileManagementConfig(
+    tools = {t.name: t for t in FileManagementToolkit(root_dir = configs.workspace_dir).get_tools()},
+    index = WorkspaceIndex(configs.workspace_dir, ttl = configs.file_index_ttl),
+    executor = ThreadPoolExecutor(max_workers = configs.file_async_workers, thread_name_prefix = 'file_management')),
+    max_read_bytes = configs.file_read_max_bytes,
+    max_workers = configs.file_max_workers,
+    grep_processes = configs.file_grep_processes)
@@ -1,17 +1,115 @@
 #!/usr/bin/python3
 
 from uuid import uuid4
+import re
+import json
+import atexit
+import shutil
 import time
-from os import makedirs
-from os.path import join, exists
-from typing import Type, List, Optional, Annotated, Literal, Union
-from pydantic import BaseModel, Field, ValidationError, model_validator
+import shlex
+import asyncio
+import subprocess
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future
+from os import makedirs, remove
+from os.path import join, exists, getsize, abspath
+from typing import Type, List, Optional, Annotated, Literal, Union, Dict, Any, Iterator, AsyncIterator
+from pydantic import BaseModel, Field, InstanceOf, ValidationError, model_validator
 from langchain_core.tools.structured import StructuredTool
-from langchain_core.callbacks.manager import CallbackManagerForToolRun
+from langchain_core.callbacks.manager import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
 import libtmux
 
 # NOTE: langchain-community has ShellTool which provide shell execution, but it cannot handle commands which blocks terminal
 
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+PANE_FORMAT = "#{session_name}\t#{session_id}\t#{pane_id}\t#{window_active}#{pane_active}"
+ACTIONS_DESCRIPTION = """list_actions: elaborate the functionalities of all actions.
+execute_command: create a tmux session and execute a given command under a specified directory in the session.
+check_command_output: get the output of a given session, optionally only the output after a given offset or the last lines. long output is returned in pages, each ending with the offset of the next one.
+terminate_command: terminate execution of a given session.
+list_sessions: list all available sessions."""
+COMMAND_ECHO = re.compile(r" \. \S+/cmd_[0-9a-f]{8}\.sh")
+
+class ControlModeCommand(object):
+  # result of a command sent over the control connection, shaped like libtmux.common.tmux_cmd
+  def __init__(self, cmd, stdout, stderr):
+    self.cmd = cmd
+    self.stdout = stdout
+    self.stderr = stderr
+    self.returncode = 1 if stderr else 0
+
+class ControlModeServer(libtmux.Server):
+  # libtmux server whose commands are multiplexed over one long-lived `tmux -C` connection instead of a process per command
+  def __init__(self, **kwargs):
+    super(ControlModeServer, self).__init__(**kwargs)
+    self.control_session = f"control_{uuid4().hex[:8]}"
+    self._lock = threading.Lock()
+    self._process = None
+    self._pending = deque()
+  def _server_args(self):
+    args = [self.tmux_bin or 'tmux']
+    if self.socket_name: args.append(f"-L{self.socket_name}")
+    if self.socket_path: args.append(f"-S{self.socket_path}")
+    if self.config_file: args.append(f"-f{self.config_file}")
+    return args
+  def _connect(self):
+    # a control client must be attached to a session, the control session goes away together with the connection
+    self._process = subprocess.Popen(
+      self._server_args() + ['-C', 'new-session', '-s', self.control_session, 'cat', ';', 'set-option', '-t', self.control_session, 'destroy-unattached', 'on'],
+      stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+    self._pending = deque()
+    threading.Thread(target = self._read, args = (self._process, self._pending), daemon = True).start()
+  def _read(self, process, pending):
+    # replies of commands sent by us are framed by %begin/%end (or %error) with flags 1 and arrive in order,
+    # notifications such as %output are skipped because pane output is streamed through pipe-pane
+    number, block = None, None
+    for raw in process.stdout:
+      line = raw.decode('utf-8', errors = 'backslashreplace').rstrip('\n')
+      fields = line.split(' ')
+      if number is None:
+        if fields[0] == '%begin' and len(fields) == 4 and fields[3] == '1':
+          number, block = fields[2], list()
+      elif fields[0] in ('%end', '%error') and len(fields) == 4 and fields[2] == number:
+        future = pending.popleft()
+        future.set_result((block, list()) if fields[0] == '%end' else (list(), list(filter(None, block))))
+        number, block = None, None
+      else:
+        block.append(line)
+    while pending:
+      pending.popleft().set_exception(libtmux.exc.LibTmuxException("tmux control mode connection closed"))
+  def _quote(self, arg):
+    arg = str(arg)
+    for char, escaped in (('\\', '\\\\'), ('"', '\\"'), ('$', '\\$'), ('\n', '\\n'), ('\r', '\\r'), ('\t', '\\t')):
+      arg = arg.replace(char, escaped)
+    return f'"{arg}"'
+  def submit(self, cmd, *args):
+    line = " ".join(self._quote(arg) for arg in (cmd, *args)) + "\n"
+    future = Future()
+    with self._lock:
+      if self._process is None or self._process.poll() is not None:
+        self._connect()
+      self._pending.append(future)
+      self._process.stdin.write(line.encode('utf-8'))
+      self._process.stdin.flush()
+    return future
+  def cmd(self, cmd, *args, target = None):
+    # NOTE: wait-for blocks the client which issues it, it must not be sent over the shared connection
+    assert cmd != 'wait-for', "wait-for is not supported over the control connection!"
+    args = ['-t', str(target), *args] if target is not None else list(args)
+    stdout, stderr = self.submit(cmd, *args).result()
+    return ControlModeCommand([cmd, *args], stdout, stderr)
+  async def acmd(self, cmd, *args):
+    assert cmd != 'wait-for', "wait-for is not supported over the control connection!"
+    return await asyncio.wrap_future(self.submit(cmd, *args))
+  def close(self):
+    with self._lock:
+      if self._process is not None and self._process.poll() is None:
+        self._process.stdin.close()
+        self._process.wait()
+      self._process = None
+
 def load_shell_tool(configs):
   class ListActions(BaseModel):
     pass
@@ -23,6 +121,8 @@ def load_shell_tool(configs):
     timeout: Optional[int] = Field(60, description = "Optional timeout in seconds for blocking commands. Defaults to 60. Ignored for non-blocking commands.")
   class CheckCommandOutput(BaseModel):
     session_name: str = Field(description = "name of the tmux session to use. Use named sessions for related commands that need to maintain state.")
+    offset: Optional[int] = Field(None, description = "Optional offset returned by a previous check of this session. Only output produced after it is returned. Defaults to the start of the latest command.")
+    tail: Optional[int] = Field(None, description = "Optional number of lines. Only the last lines of the output are returned.")
   class TerminateCommand(BaseModel):
     session_name: str = Field(description = "name of the tmux session to use. Use named sessions for related commands that need to maintain state.")
   class ListSessions(BaseModel):
@@ -57,10 +157,28 @@ def load_shell_tool(configs):
     session_name: Optional[str] = Field(None, description = "Optional name of the tmux session to use.")
     output: Optional[str] = Field(None, description = "output of the input command or a list of available session names")
     completed: bool = Field(False, description = "whether the command completed?")
+    exit_code: Optional[int] = Field(None, description = "exit code of the command if it completed")
+    offset: Optional[int] = Field(None, description = "offset to pass to the next check_command_output to get only new output")
+  class SessionHandle(BaseModel):
+    class Config:
+      arbitrary_types_allowed = True
+    session: InstanceOf[libtmux.Session]
+    pane: InstanceOf[libtmux.Pane]
+    alive_path: str = Field(description = "file removed by the pane's log pipe when the pane exits")
   class ShellConfig(BaseModel):
     class Config:
       arbitrary_types_allowed = True
     server: libtmux.Server
+    state_dir: str = Field(description = "directory holding the exit status files and output logs of sessions")
+    offsets: Dict[str, int] = Field(default_factory = dict, description = "log offset where the latest command of each session starts")
+    sessions: Dict[str, SessionHandle] = Field(default_factory = dict, description = "registry of known sessions keyed by session name")
+    pool_size: int = Field(0, description = "number of idle sessions kept ready for commands without a session name")
+    pool_idle_timeout: float = Field(600, description = "seconds after which an idle pooled session is recycled")
+    pool_reuse: bool = Field(False, description = "whether sessions of finished blocking commands return to the pool instead of being killed")
+    pool: Dict[str, float] = Field(default_factory = dict, description = "idle pooled session names and the time they became idle")
+    pool_lock: Any = Field(default_factory = threading.Lock)
+    pool_refilling: bool = False
+    closed: Any = Field(default_factory = threading.Event, description = "set once the tool is closed, stops the pool reaper")
   class ShellTool(StructuredTool):
     name: str = "shell"
     description: str = """Execute a shell command in the workspace directory.
@@ -71,76 +189,423 @@ This tool is essential for running CLI tools, installing packages, and managing
     args_schema: Type[BaseModel] = ShellInput
     config: ShellConfig
     workspace_path: str = Field(default = "/workspace")
-    done_marker: str = Field(default = f"DONE_{str(uuid4())}")
+    max_read_bytes: int = Field(default = 64 * 1024)
+    def _status_path(self, session_name):
+      return join(self.config.state_dir, f"{session_name}.status")
+    def _log_path(self, session_name):
+      return join(self.config.state_dir, f"{session_name}.log")
+    def _server_args(self):
+      server = self.config.server
+      args = [server.tmux_bin or 'tmux']
+      if server.socket_name: args.append(f"-L{server.socket_name}")
+      if server.socket_path: args.append(f"-S{server.socket_path}")
+      return args
+    def _make_handle(self, session_name, session_id, pane_id):
+      # stream everything printed in the pane to the session log, the pipe removes the alive file once the pane exits
+      server = self.config.server
+      handle = SessionHandle(
+        session = libtmux.Session(server = server, session_id = session_id),
+        pane = libtmux.Pane(server = server, pane_id = pane_id),
+        alive_path = join(self.config.state_dir, f"{session_name}_{uuid4().hex[:8]}.alive"))
+      open(handle.alive_path, 'w').close()
+      self.config.sessions[session_name] = handle
+      return handle, f"cat >> {shlex.quote(self._log_path(session_name))} ; rm -f {shlex.quote(handle.alive_path)}"
+    def _register(self, session_name, session_id, pane_id):
+      handle, pipe_command = self._make_handle(session_name, session_id, pane_id)
+      handle.pane.cmd('pipe-pane', pipe_command)
+      return handle
+    async def _aregister(self, session_name, session_id, pane_id):
+      handle, pipe_command = self._make_handle(session_name, session_id, pane_id)
+      await self._atmux('pipe-pane', '-t', pane_id, pipe_command)
+      return handle
+    def _unregister(self, session_name):
+      handle = self.config.sessions.pop(session_name, None)
+      if handle is None: return
+      try:
+        remove(handle.alive_path)
+      except FileNotFoundError:
+        # the log pipe of a killed pane may have removed it already
+        pass
+    def _cached_session(self, session_name):
+      handle = self.config.sessions.get(session_name)
+      return handle if handle is not None and exists(handle.alive_path) else None
+    def _resync(self, stdout, stderr):
+      # rebuild the registry from the active pane of every session, sessions gone from tmux are dropped
+      panes = dict()
+      for line in stdout if not stderr else []:
+        name, session_id, pane_id, active = line.split('\t')
+        if active == '11': panes[name] = (session_id, pane_id)
+      for name, handle in list(self.config.sessions.items()):
+        if not exists(handle.alive_path): self._cleanup(name)
+      return panes
+    def _get_session(self, session_name):
+      handle = self._cached_session(session_name)
+      if handle is not None: return handle
+      # registry miss or the session exited, resync against tmux with a single round trip
+      proc = self.config.server.cmd('list-panes', '-a', '-F', PANE_FORMAT)
+      panes = self._resync(proc.stdout, proc.stderr)
+      if session_name not in panes: return None
+      return self._register(session_name, *panes[session_name])
+    async def _aget_session(self, session_name):
+      handle = self._cached_session(session_name)
+      if handle is not None: return handle
+      panes = self._resync(*await self._atmux('list-panes', '-a', '-F', PANE_FORMAT))
+      if session_name not in panes: return None
+      return await self._aregister(session_name, *panes[session_name])
+    def _new_session(self, session_name):
+      proc = self.config.server.cmd('new-session', '-d', '-s', session_name, '-P', '-F', '#{session_id}\t#{pane_id}')
+      assert not proc.stderr, f"failed to create session: {proc.stderr}"
+      return self._register(session_name, *proc.stdout[0].split('\t'))
+    async def _anew_session(self, session_name):
+      stdout, stderr = await self._atmux('new-session', '-d', '-s', session_name, '-P', '-F', '#{session_id}\t#{pane_id}')
+      assert not stderr, f"failed to create session: {stderr}"
+      return await self._aregister(session_name, *stdout[0].split('\t'))
+    def _take_pooled(self):
+      # hand out the most recently idle pooled session, expired ones are left for the refill to recycle
+      taken = None
+      with self.config.pool_lock:
+        for session_name, idle_since in reversed(list(self.config.pool.items())):
+          handle = self._cached_session(session_name)
+          if handle is not None and time.time() - idle_since <= self.config.pool_idle_timeout:
+            self.config.pool.pop(session_name)
+            taken = session_name, handle
+            break
+      self._refill_pool()
+      return taken
+    def _release_to_pool(self, session_name):
+      # sessions of finished anonymous commands are reused when enabled and the pool has room
+      with self.config.pool_lock:
+        if not self.config.pool_reuse or len(self.config.pool) >= self.config.pool_size: return False
+      handle = self._cached_session(session_name)
+      if handle is None: return False
+      open(self._log_path(session_name), 'w').close()
+      remove(self._status_path(session_name))
+      self.config.offsets.pop(session_name, None)
+      threading.Thread(target = self._reset_pooled, args = (session_name, handle), daemon = True).start()
+      return True
+    def _reset_pooled(self, session_name, handle):
+      # a fresh shell replaces the used one so that the next command does not inherit the cwd, environment or functions
+      # of the previous one, the pane and its log pipe stay in place
+      channel = f"ready_{str(uuid4())}"
+      handle.pane.cmd('respawn-pane', '-k', '-c', self.workspace_path)
+      handle.pane.send_keys(f" tmux wait-for -S {channel}")
+      ready = self._wait_for(channel, 60)
+      with self.config.pool_lock:
+        if ready and len(self.config.pool) < self.config.pool_size:
+          self.config.pool[session_name] = time.time()
+          return
+      handle.session.kill()
+      self._cleanup(session_name)
+    def _refill_pool(self):
+      # sessions are spawned in the background so that callers never wait for a shell to start
+      if self.config.pool_size <= 0: return
+      with self.config.pool_lock:
+        if self.config.pool_refilling: return
+        self.config.pool_refilling = True
+      threading.Thread(target = self._fill_pool, daemon = True).start()
+    def _fill_pool(self):
+      try:
+        while True:
+          with self.config.pool_lock:
+            expired = [name for name, idle_since in self.config.pool.items() if time.time() - idle_since > self.config.pool_idle_timeout or self._cached_session(name) is None]
+            for name in expired: self.config.pool.pop(name)
+            if not expired and len(self.config.pool) >= self.config.pool_size:
+              self.config.pool_refilling = False
+              return
+          for name in expired:
+            handle = self._cached_session(name)
+            if handle is not None: handle.session.kill()
+            self._cleanup(name)
+          if len(self.config.pool) < self.config.pool_size:
+            # a session joins the pool only once its shell finished starting up
+            session_name, channel = f"session_{str(uuid4())[:8]}", f"ready_{str(uuid4())}"
+            handle = self._new_session(session_name)
+            handle.pane.send_keys(f" cd {shlex.quote(self.workspace_path)} ; tmux wait-for -S {channel}")
+            if not self._wait_for(channel, 60):
+              handle.session.kill()
+              self._cleanup(session_name)
+              raise Exception("pooled session failed to start!")
+            with self.config.pool_lock:
+              if not self.config.closed.is_set():
+                self.config.pool[session_name] = time.time()
+                continue
+            # closed while the session was starting
+            handle.session.kill()
+            self._cleanup(session_name)
+      except Exception:
+        with self.config.pool_lock:
+          self.config.pool_refilling = False
+        raise
+    def _reap_pool(self):
+      # recycle expired idle sessions even while no command arrives to trigger a refill
+      while not self.config.closed.wait(max(self.config.pool_idle_timeout / 2, 1)):
+        self._refill_pool()
+    def close(self):
+      # kill the idle pooled sessions, stop the reaper and refills, and remove the state directory
+      with self.config.pool_lock:
+        self.config.closed.set()
+        pooled, self.config.pool_size = list(self.config.pool), 0
+        self.config.pool.clear()
+      for session_name in pooled:
+        handle = self._cached_session(session_name)
+        if handle is not None: handle.session.kill()
+        self._unregister(session_name)
+      if isinstance(self.config.server, ControlModeServer):
+        self.config.server.close()
+      shutil.rmtree(self.config.state_dir, ignore_errors = True)
+    def _read_log(self, session_name, offset = None, tail = None):
+      # at most max_read_bytes are read, returns the output, the offset to continue from and whether more output follows it
+      log_path = self._log_path(session_name)
+      if offset is None: offset = self.config.offsets.get(session_name, 0)
+      if not exists(log_path): return "", offset, False
+      with open(log_path, 'rb') as f:
+        if tail is not None:
+          # seek back from the end until enough lines are found instead of reading the whole log
+          end = f.seek(0, 2)
+          floor, start, lines = max(offset, end - self.max_read_bytes), end, 0
+          while start > floor and lines <= tail:
+            step = min(8192, start - floor)
+            start -= step
+            f.seek(start)
+            lines += f.read(step).count(b'\n')
+          f.seek(start)
+          content, more = f.read(end - start), False
+        else:
+          f.seek(offset)
+          content = f.read(self.max_read_bytes + 1)
+          more = len(content) > self.max_read_bytes
+          if more:
+            # stop at a line end, unless a single line exceeds the limit
+            cut = content.rfind(b'\n', 0, self.max_read_bytes)
+            content = content[:cut + 1 if cut >= 0 else self.max_read_bytes]
+          end = offset + len(content)
+      output = ANSI_ESCAPE.sub('', content.decode('utf-8', errors = 'replace')).replace('\r', '')
+      # hide the echoed invocation of the command scripts
+      output = COMMAND_ECHO.sub('', output)
+      if tail is not None:
+        output = "\n".join(output.splitlines()[-tail:])
+      return output, end, more
+    def _with_hint(self, output, offset, more):
+      return output + f"\n... more output, use check_command_output with offset {offset} to read on" if more else output
+    def _log_size(self, session_name):
+      log_path = self._log_path(session_name)
+      return getsize(log_path) if exists(log_path) else 0
+    def _settle_log(self, session_name, interval = 0.01, timeout = 0.5):
+      # the pipe to the log is written asynchronously, wait until it stops growing after the command finished
+      size, start_time = -1, time.time()
+      while time.time() - start_time < timeout:
+        new_size = self._log_size(session_name)
+        if new_size == size: break
+        size = new_size
+        time.sleep(interval)
+    async def _asettle_log(self, session_name, interval = 0.01, timeout = 0.5):
+      size, start_time = -1, time.time()
+      while time.time() - start_time < timeout:
+        new_size = self._log_size(session_name)
+        if new_size == size: break
+        size = new_size
+        await asyncio.sleep(interval)
+    def _cleanup(self, session_name):
+      self._unregister(session_name)
+      for path in (self._status_path(session_name), self._log_path(session_name)):
+        if exists(path): remove(path)
+      self.config.offsets.pop(session_name, None)
+    def _exit_code(self, session_name):
+      # the exit status file only exists once the last command of the session finished
+      status_path = self._status_path(session_name)
+      if not exists(status_path): return None
+      with open(status_path, 'r') as f:
+        status = f.read().strip()
+      return int(status) if status else None
+    def _wait_for(self, channel, timeout):
+      # block on a tmux wait channel which is signaled by the command itself when it finishes
+      try:
+        subprocess.run(self._server_args() + ['wait-for', channel], timeout = timeout, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        return True
+      except subprocess.TimeoutExpired:
+        return False
+    async def _await_for(self, channel, timeout):
+      try:
+        await self._aspawn('wait-for', channel, timeout = timeout)
+        return True
+      except asyncio.TimeoutError:
+        return False
+    async def _atmux(self, *args):
+      if isinstance(self.config.server, ControlModeServer):
+        return await self.config.server.acmd(*args)
+      return await self._aspawn(*args)
+    async def _aspawn(self, *args, timeout = None):
+      proc = await asyncio.create_subprocess_exec(*self._server_args(), *args, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE)
+      try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+      except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+      stdout = stdout.decode('utf-8', errors = 'backslashreplace').splitlines()
+      stderr = list(filter(None, stderr.decode('utf-8', errors = 'backslashreplace').splitlines()))
+      return stdout, stderr
+    def _listed(self, session_name):
+      # the control session and idle pooled sessions are internal
+      return session_name != getattr(self.config.server, 'control_session', None) and session_name not in self.config.pool
+    def _prepare_command(self, session_name, execute_command):
+      # goto working dir and execute command, its exit status is written to a side file and a wait channel is signaled for blocking calls.
+      # the command and the bookkeeping go to a script which the shell sources, so that only a short fixed line is typed into the pane
+      # and echoed into the log, however the terminal wraps and redraws it
+      cwd = self.workspace_path
+      if execute_command.folder is not None:
+        cwd = join(self.workspace_path, execute_command.folder)
+        if not exists(cwd): makedirs(cwd)
+      status_path = self._status_path(session_name)
+      if exists(status_path): remove(status_path)
+      script_path = join(self.config.state_dir, f"cmd_{uuid4().hex[:8]}.sh")
+      channel = None
+      lines = [f"rm -f {shlex.quote(script_path)}", f"cd {shlex.quote(cwd)}", execute_command.command, f"echo $? > {shlex.quote(status_path)}.tmp ; mv {shlex.quote(status_path)}.tmp {shlex.quote(status_path)}"]
+      if execute_command.blocking == True:
+        channel = f"done_{str(uuid4())}"
+        lines.append(f"tmux wait-for -S {channel}")
+      with open(script_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+      self.config.offsets[session_name] = self._log_size(session_name)
+      return f" . {script_path}", channel
     def _run(self, action, list_actions = None, execute_command = None, check_command_output = None, terminate_command = None, list_sessions = None, run_manager: Optional[CallbackManagerForToolRun] = None):
       if action == "list_actions":
         assert list_actions is not None, "list_actions is None!"
-        output = """list_actions: elaborate the functionalities of all actions.
-execute_command: create a tmux session and execute a given command under a specified directory in the session.
-check_command_output: get the output of a given session.
-terminate_command: terminate execution of a given session.
-list_sessions: list all available sessions."""
-        return ShellOutput(output = output)
+        return ShellOutput(output = ACTIONS_DESCRIPTION)
       elif action == "execute_command":
         assert execute_command is not None, "execute_command is None!"
         # 1) create session or get session
         session_name = f"session_{str(uuid4())[:8]}" if execute_command.session_name is None else execute_command.session_name
-        matches = list(filter(lambda s:s.session_name == session_name, self.config.server.sessions))
-        if len(matches) == 0:
-          session = self.config.server.new_session(session_name = session_name)
-        else:
-          session = matches[0]
-        # 2) goto working dir
-        cwd = self.workspace_path
-        if execute_command.folder is not None:
-          cwd = join(self.workspace_path, execute_command.folder)
-          if not exists(cwd): makedirs(cwd)
-        # 3) execute command
-        command = f""" cd {cwd} ; {execute_command.command} ; echo "{self.done_marker}" """
-        window = session.active_window
-        pane = window.active_pane
-        pane.send_keys(command)
-        # 4) block or not
+        handle = None if execute_command.session_name is None else self._get_session(session_name)
+        pooled = self._take_pooled() if execute_command.session_name is None else None
+        if pooled is not None:
+          session_name, handle = pooled
+        elif handle is None:
+          handle = self._new_session(session_name)
+        # 2) execute command
+        command, channel = self._prepare_command(session_name, execute_command)
+        handle.pane.send_keys(command)
+        # 3) block or not
         if execute_command.blocking == True:
-          start_time = time.time()
-          while (time.time() - start_time) < execute_command.timeout:
-            time.sleep(2)
-            lines = pane.capture_pane()
-            # watch for done marker in output
-            if any(self.done_marker == line.strip() for line in lines):
-              # 5) capture output, kill session and return
-              output = "\n".join(pane.capture_pane()[:-1])
-              session.kill()
-              return ShellOutput(session_name = session_name, output = output, completed = True)
-        # 5) return session_name
+          if self._wait_for(channel, execute_command.timeout):
+            # 4) collect output from the session log, kill or reuse session and return
+            self._settle_log(session_name)
+            output, offset, more = self._read_log(session_name)
+            exit_code = self._exit_code(session_name)
+            if more:
+              # the session is kept so that the rest of the output can be read by offset
+              return ShellOutput(session_name = session_name, output = self._with_hint(output, offset, more), completed = True, exit_code = exit_code, offset = offset)
+            if execute_command.session_name is not None or not self._release_to_pool(session_name):
+              handle.session.kill()
+              self._cleanup(session_name)
+            return ShellOutput(session_name = session_name, output = output, completed = True, exit_code = exit_code)
+        # 4) return session_name
         return ShellOutput(session_name = session_name, completed = False)
       elif action == "check_command_output":
         assert check_command_output is not None, "check_command_output is None!"
-        matches = list(filter(lambda s:s.session_name == check_command_output.session_name, self.config.server.sessions))
-        assert len(matches) != 0, "cannot find session with given session_name"
-        session = matches[0]
-        window = session.active_window
-        pane = window.active_pane
-        lines = pane.capture_pane()
-        if any(self.done_marker == line.strip() for line in lines):
-          output = "\n".join(pane.capture_pane())
-          return ShellOutput(session_name = check_command_output.session_name, output = output, completed = True)
-        else:
-          output = "\n".join(pane.capture_pane())
-          return ShellOutput(session_name = check_command_output.session_name, output = output, completed = False)
+        assert self._get_session(check_command_output.session_name) is not None, "cannot find session with given session_name"
+        exit_code = self._exit_code(check_command_output.session_name)
+        output, offset, more = self._read_log(check_command_output.session_name, check_command_output.offset, check_command_output.tail)
+        return ShellOutput(session_name = check_command_output.session_name, output = self._with_hint(output, offset, more), completed = exit_code is not None, exit_code = exit_code, offset = offset)
+      elif action == "terminate_command":
+        assert terminate_command is not None, "terminate_command is None!"
+        handle = self._get_session(terminate_command.session_name)
+        assert handle is not None, "cannot find session with given session_name"
+        handle.session.kill()
+        self._cleanup(terminate_command.session_name)
+        return ShellOutput(completed = True)
+      elif action == "list_sessions":
+        assert list_sessions is not None, "list_sessions is None!"
+        sessions = [s.session_name for s in self.config.server.sessions if self._listed(s.session_name)]
+        return ShellOutput(output = json.dumps(sessions, indent = 2, ensure_ascii = False), completed = True)
+      else:
+        raise Exception("unknown action!")
+    async def _arun(self, action, list_actions = None, execute_command = None, check_command_output = None, terminate_command = None, list_sessions = None, run_manager: Optional[AsyncCallbackManagerForToolRun] = None):
+      if action == "list_actions":
+        assert list_actions is not None, "list_actions is None!"
+        return ShellOutput(output = ACTIONS_DESCRIPTION)
+      elif action == "execute_command":
+        assert execute_command is not None, "execute_command is None!"
+        # 1) create session or get session
+        session_name = f"session_{str(uuid4())[:8]}" if execute_command.session_name is None else execute_command.session_name
+        handle = None if execute_command.session_name is None else await self._aget_session(session_name)
+        pooled = self._take_pooled() if execute_command.session_name is None else None
+        if pooled is not None:
+          session_name, handle = pooled
+        elif handle is None:
+          handle = await self._anew_session(session_name)
+        # 2) execute command
+        command, channel = self._prepare_command(session_name, execute_command)
+        await self._atmux('send-keys', '-t', handle.pane.pane_id, command, 'Enter')
+        # 3) block or not
+        if execute_command.blocking == True:
+          if await self._await_for(channel, execute_command.timeout):
+            # 4) collect output from the session log, kill or reuse session and return
+            await self._asettle_log(session_name)
+            output, offset, more = await asyncio.to_thread(self._read_log, session_name)
+            exit_code = self._exit_code(session_name)
+            if more:
+              return ShellOutput(session_name = session_name, output = self._with_hint(output, offset, more), completed = True, exit_code = exit_code, offset = offset)
+            if execute_command.session_name is not None or not self._release_to_pool(session_name):
+              await self._atmux('kill-session', '-t', handle.session.session_id)
+              self._cleanup(session_name)
+            return ShellOutput(session_name = session_name, output = output, completed = True, exit_code = exit_code)
+        # 4) return session_name
+        return ShellOutput(session_name = session_name, completed = False)
+      elif action == "check_command_output":
+        assert check_command_output is not None, "check_command_output is None!"
+        assert await self._aget_session(check_command_output.session_name) is not None, "cannot find session with given session_name"
+        exit_code = self._exit_code(check_command_output.session_name)
+        output, offset, more = await asyncio.to_thread(self._read_log, check_command_output.session_name, check_command_output.offset, check_command_output.tail)
+        return ShellOutput(session_name = check_command_output.session_name, output = self._with_hint(output, offset, more), completed = exit_code is not None, exit_code = exit_code, offset = offset)
       elif action == "terminate_command":
         assert terminate_command is not None, "terminate_command is None!"
-        matches = list(filter(lambda s:s.session_name == terminate_command.session_name, self.config.server.sessions))
-        assert len(matches) != 0, "cannot find session with given session_name"
-        session = matches[0]
-        session.kill()
+        handle = await self._aget_session(terminate_command.session_name)
+        assert handle is not None, "cannot find session with given session_name"
+        await self._atmux('kill-session', '-t', handle.session.session_id)
+        self._cleanup(terminate_command.session_name)
         return ShellOutput(completed = True)
       elif action == "list_sessions":
         assert list_sessions is not None, "list_sessions is None!"
-        sessions = [s.session_name for s in self.config.server.sessions]
+        stdout, stderr = await self._atmux('list-sessions', '-F', '#{session_name}')
+        sessions = [name for name in stdout if self._listed(name)] if not stderr else []
         return ShellOutput(output = json.dumps(sessions, indent = 2, ensure_ascii = False), completed = True)
       else:
         raise Exception("unknown action!")
-    async def _arun(self, action, execute_command = None, check_command_output = None, terminate_command = None, list_sessions = None, run_manager: Optional[CallbackManagerForToolRun] = None):
-      raise NotImplementedError("Async execution is not supported!")
-  return ShellTool(config = ShellConfig(server = libtmux.Server()), workspace_path = configs.workspace_dir)
+    def stream_output(self, session_name, offset = None, interval = 0.1) -> Iterator[ShellOutput]:
+      # yield output chunks of the latest command of a session as they are written until the command completes
+      while True:
+        exit_code = self._exit_code(session_name)
+        if exit_code is not None: self._settle_log(session_name)
+        output, offset, more = self._read_log(session_name, offset)
+        if output or exit_code is not None:
+          yield ShellOutput(session_name = session_name, output = output, completed = exit_code is not None and not more, exit_code = exit_code, offset = offset)
+        if more: continue
+        if exit_code is not None: break
+        time.sleep(interval)
+    async def astream_output(self, session_name, offset = None, interval = 0.1) -> AsyncIterator[ShellOutput]:
+      while True:
+        exit_code = self._exit_code(session_name)
+        if exit_code is not None: await self._asettle_log(session_name)
+        output, offset, more = await asyncio.to_thread(self._read_log, session_name, offset)
+        if output or exit_code is not None:
+          yield ShellOutput(session_name = session_name, output = output, completed = exit_code is not None and not more, exit_code = exit_code, offset = offset)
+        if more: continue
+        if exit_code is not None: break
+        await asyncio.sleep(interval)
+  server = ControlModeServer() if configs.shell_control_mode else libtmux.Server()
+  # absolute, as pooled sessions already start in the workspace before a command changes to its folder
+  workspace_path = abspath(configs.workspace_dir)
+  shell_tool = ShellTool(config = ShellConfig(
+    server = server,
+    state_dir = tempfile.mkdtemp(prefix = "shell_"),
+    pool_size = configs.shell_pool_size,
+    pool_idle_timeout = configs.shell_pool_idle_timeout,
+    pool_reuse = configs.shell_pool_reuse),
+    workspace_path = workspace_path,
+    max_read_bytes = configs.shell_read_max_bytes)
+  shell_tool._refill_pool()
+  if shell_tool.config.pool_size > 0:
+    threading.Thread(target = shell_tool._reap_pool, daemon = True).start()
+  atexit.register(shell_tool.close)
+  return shell_tool
@@ -1,30 +1,103 @@
 #!/usr/bin/python3
 
-from os.path import getsize, splitext
+import os
+from os.path import getsize, splitext, join, realpath
 from io import BytesIO
 import base64
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Type, List, Optional, Annotated, Literal, Union
 from pydantic import BaseModel, Field, ValidationError, model_validator
 from langchain_core.tools.structured import StructuredTool
-from langchain_core.callbacks.manager import CallbackManagerForToolRun
+from langchain_core.callbacks.manager import CallbackManagerForToolRun, AsyncCallbackManagerForToolRun
 from PIL import Image
+from imaging import prepare_image, target_ratio, DEFAULT_MAX_WIDTH, DEFAULT_MAX_HEIGHT, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESS_LEVEL, DEFAULT_FAST_RESAMPLE_RATIO
 
-DEFAULT_MAX_WIDTH = 1920
-DEFAULT_MAX_HEIGHT = 1080
-DEFAULT_JPEG_QUALITY = 85
-DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_PASSTHROUGH_MAX_BYTES = 1024**2
+
+class ImageCache(object):
+  # LRU of encoded images within a byte budget, evicted entries optionally spill to files under spill_dir
+  def __init__(self, max_bytes, spill_dir = None):
+    self.max_bytes = max_bytes
+    self.spill_dir = spill_dir
+    self.entries = OrderedDict() # key -> (mime type, base64)
+    self.size = 0
+    self.lock = threading.Lock()
+  def _spill_path(self, key):
+    return join(self.spill_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest())
+  def _spill(self, evicted):
+    if self.spill_dir is None: return
+    os.makedirs(self.spill_dir, exist_ok = True)
+    for key, (mime_type, base64_image) in evicted:
+      path = self._spill_path(key)
+      if os.path.exists(path): continue
+      # written to a temporary file first so that a concurrent reader never sees a partial file
+      tmp_path = f"{path}.{threading.get_ident()}.tmp"
+      with open(tmp_path, 'wb') as f:
+        f.write(mime_type.encode('utf-8') + b'\n' + base64.b64decode(base64_image))
+      os.replace(tmp_path, path)
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        self.entries.move_to_end(key)
+        return entry
+    if self.spill_dir is None: return None
+    try:
+      with open(self._spill_path(key), 'rb') as f:
+        mime_type, img_bytes = f.read().split(b'\n', 1)
+    except (OSError, ValueError):
+      return None
+    entry = (mime_type.decode('utf-8'), base64.b64encode(img_bytes).decode('utf-8'))
+    self.put(key, *entry)
+    return entry
+  def put(self, key, mime_type, base64_image):
+    evicted = list()
+    with self.lock:
+      if key in self.entries:
+        self.size -= len(self.entries.pop(key)[1])
+      if len(base64_image) <= self.max_bytes:
+        self.entries[key] = (mime_type, base64_image)
+        self.size += len(base64_image)
+      else:
+        evicted.append((key, (mime_type, base64_image)))
+      while self.size > self.max_bytes:
+        evicted.append(self.entries.popitem(last = False))
+        self.size -= len(evicted[-1][1][1])
+    self._spill(evicted)
 
 def load_see_image_tool(configs):
   class SeeImageInput(BaseModel):
     file_path: str = Field(description = "path to image")
+    region: Optional[List[int]] = Field(None, description = "Optional region of interest to crop to, given as [left, top, right, bottom] in pixels of the original image.", min_length = 4, max_length = 4)
+    max_tokens: Optional[int] = Field(None, description = "Optional budget of vision tokens, the image is downscaled to fit it. Defaults to the configured budget.", gt = 0)
   class SeeImageOutput(BaseModel):
     mime_type: str = Field(description = "MIME type of the image")
     base64: str = Field(description = "base64 encoding of the image's bytes")
+  class SeeImageConfig(BaseModel):
+    class Config:
+      arbitrary_types_allowed = True
+    executor: ThreadPoolExecutor
+    cache: ImageCache
   class SeeImageTool(StructuredTool):
     name: str = "see_image"
     description: str = "a vision tool that allows agent to read image files. the base64 encoding of the image's bytes is returned. supported formats: JPG, PNG, GIF, WEBP, maximum size: 10MB"
     args_schema: Type[BaseModel] = SeeImageInput
-    def _run(self, file_path, run_manager: Optional[CallbackManagerForToolRun] = None):
+    config: SeeImageConfig
+    max_width: int = Field(default = DEFAULT_MAX_WIDTH)
+    max_height: int = Field(default = DEFAULT_MAX_HEIGHT)
+    jpeg_quality: int = Field(default = DEFAULT_JPEG_QUALITY)
+    png_compress_level: int = Field(default = DEFAULT_PNG_COMPRESS_LEVEL)
+    optimize: bool = Field(default = True)
+    passthrough_max_bytes: int = Field(default = DEFAULT_PASSTHROUGH_MAX_BYTES)
+    fast_resample_ratio: float = Field(default = DEFAULT_FAST_RESAMPLE_RATIO)
+    max_tokens: Optional[int] = Field(default = None)
+    def _run(self, file_path, region = None, max_tokens = None, run_manager: Optional[CallbackManagerForToolRun] = None):
+      return self._see_image(file_path, region, max_tokens)
+    def _see_image(self, file_path, region = None, max_tokens = None):
       file_size_bytes = getsize(file_path)
       if file_size_bytes / 1024**2 > 10:
         raise Exception("image over 10MB is not supported!")
@@ -39,40 +112,40 @@ def load_see_image_tool(configs):
         mime_type = "image/webp"
       else:
         raise Exception("image in format other than JPG, PNG, GIF and WEBP is not supported!")
+      # the same file seen again with the same output parameters is served from the cache
+      stat = os.stat(file_path)
+      max_tokens = max_tokens or self.max_tokens
+      key = (realpath(file_path), stat.st_mtime_ns, stat.st_size, None if region is None else tuple(region), max_tokens, self.max_width, self.max_height, self.jpeg_quality, self.png_compress_level, self.optimize, self.passthrough_max_bytes, self.fast_resample_ratio)
+      cached = self.config.cache.get(key)
+      if cached is not None:
+        return SeeImageOutput(mime_type = cached[0], base64 = cached[1])
       # compress image content
       with open(file_path, 'rb') as f:
         img_bytes = f.read()
       img = Image.open(BytesIO(img_bytes))
-      if img.mode in ("RGBA", "LA", "P"):
-        background = Image.new("RGB", img.size, (255, 255, 255))
-        if img.mode == "P":
-          img = img.convert("RGBA")
-        background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-        img = background
-      width, height = img.size
-      if width > DEFAULT_MAX_WIDTH or height > DEFAULT_MAX_HEIGHT:
-        ratio = min(DEFAULT_MAX_WIDTH / width, DEFAULT_MAX_HEIGHT / height)
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-      output = BytesIO()
-      if mime_type == "image/gif":
-        img.save(output, format="GIF", optimize=True)
-        output_mime = "image/gif"
-      elif mime_type == "image/png":
-        img.save(
-          output,
-          format="PNG",
-          optimize=True,
-          compress_level=DEFAULT_PNG_COMPRESS_LEVEL,
-        )
-        output_mime = "image/png"
+      ratio = target_ratio(img.width, img.height, self.max_width, self.max_height, max_tokens = max_tokens)
+      if region is None and ratio == 1 and len(img_bytes) <= self.passthrough_max_bytes and Image.MIME.get(img.format) == mime_type:
+        # an image within the limits in the format its extension claims is returned untouched
+        compressed_bytes, output_mime = img_bytes, mime_type
       else:
-        img.save(output, format="JPEG", quality=DEFAULT_JPEG_QUALITY, optimize=True)
-        output_mime = "image/jpeg"
-      compressed_bytes = output.getvalue()
+        # gif and png keep their format, everything else is sent as jpeg
+        format = {"image/gif": "GIF", "image/png": "PNG"}.get(mime_type, "JPEG")
+        prepared = prepare_image(img, self.max_width, self.max_height, max_tokens = max_tokens, region = region, format = format, quality = self.jpeg_quality, png_compress_level = self.png_compress_level, optimize = self.optimize, fast_resample_ratio = self.fast_resample_ratio)
+        compressed_bytes, output_mime = prepared.data, prepared.mime_type
       base64_image = base64.b64encode(compressed_bytes).decode('utf-8')
+      self.config.cache.put(key, output_mime, base64_image)
       return SeeImageOutput(base64 = base64_image, mime_type = output_mime)
-    async def _arun(self, file_path, run_manager: Optional[CallbackManagerForToolRun] = None):
-      raise NotImplementedError("Async execution is not supported!")
-  return SeeImageTool()
+    async def _arun(self, file_path, region = None, max_tokens = None, run_manager: Optional[AsyncCallbackManagerForToolRun] = None):
+      # reading and PIL decoding and encoding run on a bounded executor, at most vision_async_workers images are processed at once
+      return await asyncio.get_running_loop().run_in_executor(self.config.executor, self._see_image, file_path, region, max_tokens)
+  return SeeImageTool(config = SeeImageConfig(
+    executor = ThreadPoolExecutor(max_workers = configs.vision_async_workers, thread_name_prefix = 'see_image'),
+    cache = ImageCache(configs.vision_cache_bytes, join(configs.workspace_dir, '.see_image_cache') if configs.vision_cache_spill else None)),
+    max_width = configs.vision_max_width,
+    max_height = configs.vision_max_height,
+    jpeg_quality = configs.vision_jpeg_quality,
+    png_compress_level = configs.vision_png_compress_level,
+    optimize = configs.vision_optimize,
+    passthrough_max_bytes = configs.vision_passthrough_max_bytes,
+    fast_resample_ratio = configs.vision_fast_resample_ratio,
+    max_tokens = configs.vision_max_tokens)